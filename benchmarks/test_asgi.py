@@ -0,0 +1,52 @@
+"""
+Compares the latency of a request through `CSPMiddleware` under ASGI with the `sync_to_async`
+path that `MiddlewareMixin` provides.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from typing import TYPE_CHECKING
+
+from django.http import HttpResponse
+from django.test import AsyncRequestFactory
+from django.utils.deprecation import MiddlewareMixin
+
+import pytest
+
+from csp.constants import HEADER
+from csp.middleware import CSPMiddleware
+
+if TYPE_CHECKING:
+    from django.http import HttpRequest, HttpResponseBase
+
+    from pytest_benchmark.fixture import BenchmarkFixture
+
+arf = AsyncRequestFactory()
+
+
+class ThreadedCSPMiddleware(CSPMiddleware):
+    """Processes the request and response in a thread, as `MiddlewareMixin` does."""
+
+    __acall__ = MiddlewareMixin.__acall__
+
+
+async def get_response(request: HttpRequest) -> HttpResponseBase:
+    str(getattr(request, "csp_nonce"))
+    return HttpResponse()
+
+
+@pytest.mark.benchmark(group="asgi")
+@pytest.mark.parametrize("middleware_class", [ThreadedCSPMiddleware, CSPMiddleware], ids=["sync_to_async", "native"])
+def test_asgi_request(benchmark: BenchmarkFixture, middleware_class: type[CSPMiddleware]) -> None:
+    middleware = middleware_class(get_response)
+    loop = asyncio.new_event_loop()
+
+    def request() -> HttpResponseBase:
+        return loop.run_until_complete(middleware.__acall__(arf.get("/")))
+
+    try:
+        response = benchmark(request)
+    finally:
+        loop.close()
+    assert HEADER in response
@@ -0,0 +1,66 @@
+"""
+Benchmarks building the policy header from small and large settings, and with decorator configs.
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from django.test.utils import override_settings
+
+import pytest
+
+from csp.constants import NONCE, SELF, UNSAFE_INLINE
+from csp.utils import Policy, build_policy, compile_policy
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+    from pytest_benchmark.fixture import BenchmarkFixture
+
+SMALL = {"DIRECTIVES": {"default-src": [SELF, NONCE]}}
+
+LARGE = {
+    "DIRECTIVES": {
+        "default-src": [SELF],
+        "base-uri": [SELF],
+        "connect-src": [SELF, *(f"https://api{i}.example.com" for i in range(10))],
+        "font-src": [SELF, "https://fonts.gstatic.com"],
+        "form-action": [SELF],
+        "frame-ancestors": [SELF],
+        "frame-src": [*(f"https://embed{i}.example.com" for i in range(10))],
+        "img-src": [SELF, "data:", *(f"https://img{i}.example.com" for i in range(20))],
+        "object-src": ["'none'"],
+        "script-src": [SELF, NONCE, *(f"https://js{i}.example.com" for i in range(20))],
+        "style-src": [SELF, NONCE, UNSAFE_INLINE, "https://fonts.googleapis.com"],
+        "upgrade-insecure-requests": True,
+        "report-uri": "/csp-report/",
+    }
+}
+
+
+@pytest.fixture(params=[SMALL, LARGE], ids=["small", "large"])
+def policy_settings(request: pytest.FixtureRequest) -> Iterator[None]:
+    with override_settings(CONTENT_SECURITY_POLICY=request.param):
+        yield
+
+
+@pytest.mark.benchmark(group="build-policy")
+@pytest.mark.usefixtures("policy_settings")
+def test_build_policy(benchmark: BenchmarkFixture) -> None:
+    assert benchmark(build_policy, nonce="abc123")
+
+
+@pytest.mark.benchmark(group="build-policy")
+@pytest.mark.usefixtures("policy_settings")
+def test_build_policy_decorated(benchmark: BenchmarkFixture) -> None:
+    update = Policy({"img-src": ["https://cdn.example.com"]})
+    replace = Policy({"frame-src": [SELF]})
+    assert benchmark(build_policy, update=update, replace=replace, nonce="abc123")
+
+
+@pytest.mark.benchmark(group="compile-policy")
+@pytest.mark.usefixtures("policy_settings")
+def test_compile_policy(benchmark: BenchmarkFixture) -> None:
+    # The uncached cost, paid once per process for each policy.
+    assert benchmark(compile_policy, update={"img-src": ["https://cdn.example.com"]}).header
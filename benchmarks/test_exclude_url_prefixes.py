@@ -0,0 +1,38 @@
+"""
+Compares matching a path against `EXCLUDE_URL_PREFIXES` with `str.startswith` and with the
+precompiled `URLMatcher`, as the number of prefixes grows.
+"""
+
+from __future__ import annotations
+
+import random
+import string
+from typing import TYPE_CHECKING
+
+import pytest
+
+from csp.utils import URLMatcher
+
+if TYPE_CHECKING:
+    from pytest_benchmark.fixture import BenchmarkFixture
+
+PATH = "/not/excluded/path/"
+
+
+def make_prefixes(count: int) -> list[str]:
+    rand = random.Random(count)
+    return ["/" + "".join(rand.choices(string.ascii_lowercase, k=rand.randint(3, 10))) + "/" for _ in range(count)]
+
+
+@pytest.mark.benchmark(group="exclude-url-prefixes")
+@pytest.mark.parametrize("count", [10, 100, 1000])
+def test_startswith(benchmark: BenchmarkFixture, count: int) -> None:
+    prefixes = make_prefixes(count)
+    assert benchmark(lambda: PATH.startswith(tuple(prefixes))) is False
+
+
+@pytest.mark.benchmark(group="exclude-url-prefixes")
+@pytest.mark.parametrize("count", [10, 100, 1000])
+def test_url_matcher(benchmark: BenchmarkFixture, count: int) -> None:
+    matcher = URLMatcher(make_prefixes(count))
+    assert benchmark(matcher.matches, PATH) is False
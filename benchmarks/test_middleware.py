@@ -0,0 +1,56 @@
+"""
+Benchmarks a request through `CSPMiddleware` and `RateLimitedCSPMiddleware`, end to end.
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.test.utils import override_settings
+
+import pytest
+
+from csp.constants import HEADER, NONCE, SELF
+from csp.contrib.rate_limiting import RateLimitedCSPMiddleware
+from csp.decorators import csp_update
+from csp.middleware import CSPMiddleware
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+    from django.http import HttpRequest, HttpResponseBase
+
+    from pytest_benchmark.fixture import BenchmarkFixture
+
+rf = RequestFactory()
+
+
+def view(request: HttpRequest) -> HttpResponseBase:
+    return HttpResponse(f"<script nonce='{getattr(request, 'csp_nonce')}'></script>")
+
+
+@csp_update({"img-src": ["https://cdn.example.com"]})
+def decorated_view(request: HttpRequest) -> HttpResponseBase:
+    return view(request)
+
+
+def run(middleware: CSPMiddleware, get_response: Callable[[HttpRequest], HttpResponseBase]) -> HttpResponseBase:
+    request = rf.get("/")
+    middleware.process_request(request)
+    return middleware.process_response(request, get_response(request))
+
+
+@pytest.mark.benchmark(group="middleware")
+@pytest.mark.parametrize("get_response", [view, decorated_view], ids=["plain", "decorated"])
+def test_process_response(benchmark: BenchmarkFixture, get_response: Callable[[HttpRequest], HttpResponseBase]) -> None:
+    middleware = CSPMiddleware(get_response)
+    assert HEADER in benchmark(run, middleware, get_response)
+
+
+@pytest.mark.benchmark(group="middleware")
+@override_settings(CONTENT_SECURITY_POLICY={"REPORT_PERCENTAGE": 10, "DIRECTIVES": {"default-src": [SELF, NONCE], "report-uri": "/csp-report/"}})
+def test_rate_limited_process_response(benchmark: BenchmarkFixture) -> None:
+    middleware = RateLimitedCSPMiddleware(view)
+    assert HEADER in benchmark(run, middleware, view)
@@ -0,0 +1,25 @@
+"""
+Compares generating a nonce with one `os.urandom` call per nonce and with a `NoncePool`.
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+import pytest
+
+from csp.nonce import NoncePool, random_nonce
+
+if TYPE_CHECKING:
+    from pytest_benchmark.fixture import BenchmarkFixture
+
+
+@pytest.mark.benchmark(group="nonce")
+def test_random_nonce(benchmark: BenchmarkFixture) -> None:
+    benchmark(random_nonce)
+
+
+@pytest.mark.benchmark(group="nonce")
+@pytest.mark.parametrize("size", [64, 256, 1024])
+def test_nonce_pool(benchmark: BenchmarkFixture, size: int) -> None:
+    benchmark(NoncePool(size=size))
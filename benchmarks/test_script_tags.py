@@ -0,0 +1,55 @@
+"""
+Benchmarks rendering nonced script tags, directly and with the Django and Jinja template tags.
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from django.template import Context, Template, engines
+from django.test import RequestFactory
+
+import pytest
+
+from csp.middleware import CSPMiddleware
+from csp.tests.utils import response
+from csp.utils import build_script_tag
+
+if TYPE_CHECKING:
+    from django.http import HttpRequest
+
+    from pytest_benchmark.fixture import BenchmarkFixture
+
+SCRIPT = """
+    <script type="text/javascript">
+        var hello = 'world';
+    </script>
+"""
+
+mw = CSPMiddleware(response())
+rf = RequestFactory()
+
+
+def nonced_request() -> HttpRequest:
+    request = rf.get("/")
+    mw.process_request(request)
+    return request
+
+
+@pytest.mark.benchmark(group="script-tags")
+def test_build_script_tag(benchmark: BenchmarkFixture) -> None:
+    assert benchmark(build_script_tag, SCRIPT, nonce="abc123", id="hello", defer=True)
+
+
+@pytest.mark.benchmark(group="script-tags")
+def test_nonce_script_node_render(benchmark: BenchmarkFixture) -> None:
+    template = Template("{% load csp %}{% script id='hello' defer=True %}" + SCRIPT + "{% endscript %}")
+    context = Context({"request": nonced_request()})
+    assert benchmark(template.render, context)
+
+
+@pytest.mark.benchmark(group="script-tags")
+def test_jinja_nonced_script(benchmark: BenchmarkFixture) -> None:
+    template = engines["jinja2"].from_string("{% script id='hello' defer=True %}" + SCRIPT + "{% endscript %}")
+    context = {"request": nonced_request()}
+    assert benchmark(template.render, context)
@@ -127,3 +127,62 @@ def check_exclude_url_prefixes_is_not_string(app_configs: Sequence[AppConfig] |
             )
 
     return errors
+
+
+@register(checks.Tags.security)
+def check_content_types_is_not_string(app_configs: Sequence[AppConfig] | None, **kwargs: Any) -> list[Error]:
+    """
+    Check that CONTENT_TYPES in settings is not a string.
+
+    If it is a string it would be treated as a list of characters, matching no content types and
+    excluding the CSP header from all responses.
+
+    """
+    errors = []
+    keys = (
+        "CONTENT_SECURITY_POLICY",
+        "CONTENT_SECURITY_POLICY_REPORT_ONLY",
+    )
+    for key in keys:
+        config = getattr(settings, key, {})
+        if isinstance(config, dict) and isinstance(config.get("CONTENT_TYPES"), str):
+            errors.append(
+                Error(
+                    f"CONTENT_TYPES in {key} settings must be a list or tuple.",
+                    id="csp.E003",
+                )
+            )
+
+    return errors
+
+
+@register(checks.Tags.security)
+def check_report_only_sampling(app_configs: Sequence[AppConfig] | None, **kwargs: Any) -> list[Error]:
+    """
+    Check that SAMPLE_PERCENTAGE in the report-only settings is a percentage, with a SAMPLE_KEY.
+
+    Otherwise the misconfiguration would only be raised by the middleware, failing every response.
+
+    """
+    errors: list[Error] = []
+    config = getattr(settings, "CONTENT_SECURITY_POLICY_REPORT_ONLY", {})
+    percentage = config.get("SAMPLE_PERCENTAGE") if isinstance(config, dict) else None
+    if percentage is None:
+        return errors
+
+    if config.get("SAMPLE_KEY") is None:
+        errors.append(
+            Error(
+                "SAMPLE_PERCENTAGE in CONTENT_SECURITY_POLICY_REPORT_ONLY settings requires a SAMPLE_KEY.",
+                id="csp.E004",
+            )
+        )
+    if isinstance(percentage, bool) or not isinstance(percentage, (int, float)) or not 0 <= percentage <= 100:
+        errors.append(
+            Error(
+                "SAMPLE_PERCENTAGE in CONTENT_SECURITY_POLICY_REPORT_ONLY settings must be a number between 0 and 100.",
+                id="csp.E005",
+            )
+        )
+
+    return errors
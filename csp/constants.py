@@ -2,6 +2,8 @@ from typing import Any
 
 HEADER = "Content-Security-Policy"
 HEADER_REPORT_ONLY = "Content-Security-Policy-Report-Only"
+HEADER_REPORTING_ENDPOINTS = "Reporting-Endpoints"
+HEADER_REPORT_TO = "Report-To"
 
 NONE = "'none'"
 REPORT_SAMPLE = "'report-sample'"
@@ -13,6 +15,9 @@ UNSAFE_HASHES = "'unsafe-hashes'"
 UNSAFE_INLINE = "'unsafe-inline'"
 WASM_UNSAFE_EVAL = "'wasm-unsafe-eval'"
 
+# Content types of HTML documents, for use with the `CONTENT_TYPES` policy setting.
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+
 
 class Nonce:
     _instance = None
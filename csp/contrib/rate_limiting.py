@@ -1,19 +1,156 @@
 from __future__ import annotations
 
+import os
 import random
-from typing import TYPE_CHECKING
+import struct
+import threading
+import time
+from typing import TYPE_CHECKING, Any
 
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.deprecation import MiddlewareMixin
 
 from csp.middleware import CSPMiddleware, PolicyParts
 
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # type: ignore[assignment]
+
 if TYPE_CHECKING:
     from django.http import HttpRequest, HttpResponseBase
 
 
+class TokenBucket:
+    """
+    Allows `rate` events per second on average, and bursts of up to `burst` events.
+
+    The bucket is shared by the threads of a process.
+    """
+
+    def __init__(self, rate: float, burst: float | None = None) -> None:
+        self.rate = rate
+        self.burst = max(rate, 1.0) if burst is None else burst
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, tokens: float, updated: float, now: float) -> float:
+        # A clock that went backwards, e.g. a file written before a reboot, refills the bucket.
+        if now < updated:
+            return self.burst
+        return min(self.burst, tokens + (now - updated) * self.rate)
+
+    def take(self) -> bool:
+        """Takes a token, returning False if the bucket is empty."""
+        with self._lock:
+            now = time.monotonic()
+            tokens = self._refill(self._tokens, self._updated, now)
+            self._updated = now
+            if tokens < 1.0:
+                self._tokens = tokens
+                return False
+            self._tokens = tokens - 1.0
+            return True
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    A `TokenBucket` shared by every process on the host opening the same file.
+
+    The bucket's state is read and written under an exclusive lock on the file, so it's only
+    available where `fcntl` is.
+    """
+
+    _STATE = struct.Struct("dd")
+
+    def __init__(self, path: str, rate: float, burst: float | None = None) -> None:
+        if fcntl is None:  # pragma: no cover
+            raise ImproperlyConfigured("REPORT_RATE_LIMIT_FILE requires the fcntl module.")
+        super().__init__(rate, burst)
+        # `lockf` locks are held by the process rather than the file descriptor, so the descriptor
+        # can be inherited by forked workers. The thread lock excludes threads of the same process.
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+
+    def take(self) -> bool:
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                now = time.monotonic()
+                state = os.pread(self._fd, self._STATE.size, 0)
+                if len(state) == self._STATE.size:
+                    tokens, updated = self._STATE.unpack(state)
+                    tokens = self._refill(tokens, updated, now)
+                else:
+                    tokens = self.burst
+                allowed = tokens >= 1.0
+                if allowed:
+                    tokens -= 1.0
+                os.pwrite(self._fd, self._STATE.pack(tokens, now), 0)
+                return allowed
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    def close(self) -> None:
+        """Closes the file holding the bucket's state."""
+        with self._lock:
+            if self._fd >= 0:
+                os.close(self._fd)
+                self._fd = -1
+
+
+# Buckets for the `REPORT_RATE_LIMIT` settings, keyed by `report_only`.
+_report_buckets: dict[bool, TokenBucket | None] = {}
+
+
+@receiver(setting_changed)
+def _clear_report_buckets(*, setting: str, **kwargs: Any) -> None:
+    if setting in ("CONTENT_SECURITY_POLICY", "CONTENT_SECURITY_POLICY_REPORT_ONLY"):
+        for bucket in _report_buckets.values():
+            if isinstance(bucket, SharedTokenBucket):
+                bucket.close()
+        _report_buckets.clear()
+
+
+def get_report_bucket(report_only: bool = False) -> TokenBucket | None:
+    """
+    Returns the bucket for the ``REPORT_RATE_LIMIT`` of the policy in the settings, or None if
+    the policy has no rate limit.
+
+    The bucket is kept until the settings change.
+    """
+    try:
+        return _report_buckets[report_only]
+    except KeyError:
+        setting_name = "CONTENT_SECURITY_POLICY_REPORT_ONLY" if report_only else "CONTENT_SECURITY_POLICY"
+        policy = getattr(settings, setting_name, None) or {}
+        rate = policy.get("REPORT_RATE_LIMIT", None)
+        bucket: TokenBucket | None = None
+        if rate is not None:
+            burst = policy.get("REPORT_RATE_LIMIT_BURST", None)
+            path = policy.get("REPORT_RATE_LIMIT_FILE", None)
+            bucket = SharedTokenBucket(path, rate, burst) if path else TokenBucket(rate, burst)
+        _report_buckets[report_only] = bucket
+        return bucket
+
+
 class RateLimitedCSPMiddleware(CSPMiddleware):
     """A CSP middleware that rate-limits the number of violation reports sent
-    to report-uri by excluding it from some requests."""
+    to report-uri by excluding it from some requests.
+
+    The policies with and without the reporting directives are compiled and cached separately, so
+    leaving the directives out of a response doesn't rebuild its policy.
+
+    Under ASGI, taking a token from a `SharedTokenBucket` would block the event loop on the
+    file's lock, so responses are processed in a thread when ``REPORT_RATE_LIMIT_FILE`` is set."""
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponseBase:
+        if isinstance(get_report_bucket(), SharedTokenBucket) or isinstance(get_report_bucket(report_only=True), SharedTokenBucket):
+            return await MiddlewareMixin.__acall__(self, request)
+        return await super().__acall__(request)
 
     def get_policy_parts(self, request: HttpRequest, response: HttpResponseBase, report_only: bool = False) -> PolicyParts:
         policy_parts = super().get_policy_parts(request, response, report_only)
@@ -23,20 +160,15 @@ class RateLimitedCSPMiddleware(CSPMiddleware):
         if policy is None:
             return policy_parts
 
-        # `random.random` returns a value in the range [0.0, 1.0) so all values will be < 100.0.
-        remove_report = random.random() * 100 >= policy.get("REPORT_PERCENTAGE", 100)
-        if remove_report:
-            if policy_parts.replace is None:
-                policy_parts.replace = {
-                    "report-uri": None,
-                    "report-to": None,
-                }
-            else:
-                policy_parts.replace.update(
-                    {
-                        "report-uri": None,
-                        "report-to": None,
-                    }
-                )
+        if not self._should_report(policy, report_only):
+            policy_parts.reporting = False
 
         return policy_parts
+
+    def _should_report(self, policy: dict[str, Any], report_only: bool) -> bool:
+        # `random.random` returns a value in the range [0.0, 1.0) so all values will be < 100.0.
+        if random.random() * 100 >= policy.get("REPORT_PERCENTAGE", 100):
+            return False
+        # Only responses sampled by the percentage take a token.
+        bucket = get_report_bucket(report_only)
+        return bucket is None or bucket.take()
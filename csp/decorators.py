@@ -1,14 +1,53 @@
 from __future__ import annotations
 
 from functools import wraps
-from typing import TYPE_CHECKING, Any, Callable
+from typing import TYPE_CHECKING, Any, Callable, Protocol, TypeVar, Union
+
+from asgiref.sync import iscoroutinefunction
+
+from csp.utils import Policy
 
 if TYPE_CHECKING:
-    from django.http import HttpRequest, HttpResponseBase
+    from collections.abc import Awaitable
+
+    from django.http import HttpResponseBase
+
+    # A generic Django view function, sync or async
+    _VIEW_T = TypeVar("_VIEW_T", bound=Callable[..., Union[HttpResponseBase, Awaitable[HttpResponseBase]]])
+
+    class _VIEW_DECORATOR_T(Protocol):
+        def __call__(self, f: _VIEW_T, /) -> _VIEW_T: ...
+
+
+def _set_response_attr(attr: str, value: Any) -> _VIEW_DECORATOR_T:
+    """Returns a decorator that sets `attr` to `value` on the responses of a sync or async view."""
+
+    def decorator(f: _VIEW_T) -> _VIEW_T:
+        view: Callable[..., Any] = f
+
+        if iscoroutinefunction(f):
+            # Async views keep running on the event loop rather than being adapted to sync.
+            async def _wrapped_async(*a: Any, **kw: Any) -> HttpResponseBase:
+                resp: HttpResponseBase = await view(*a, **kw)
+                setattr(resp, attr, value)
+                return resp
+
+            wrapped: Callable[..., Any] = wraps(f)(_wrapped_async)
+        else:
+
+            def _wrapped(*a: Any, **kw: Any) -> HttpResponseBase:
+                resp: HttpResponseBase = view(*a, **kw)
+                setattr(resp, attr, value)
+                return resp
 
-    # A generic Django view function
-    _VIEW_T = Callable[[HttpRequest], HttpResponseBase]
-    _VIEW_DECORATOR_T = Callable[[_VIEW_T], _VIEW_T]
+            wrapped = wraps(f)(_wrapped)
+
+        # Also set on the view, so its policy can be precompiled without calling it. `wraps` copies
+        # the attributes of inner decorators, so stacked decorators all show up on the outermost view.
+        setattr(wrapped, attr, value)
+        return wrapped  # type: ignore[return-value]
+
+    return decorator
 
 
 def csp_exempt(REPORT_ONLY: bool | None = None) -> _VIEW_DECORATOR_T:
@@ -20,19 +59,7 @@ def csp_exempt(REPORT_ONLY: bool | None = None) -> _VIEW_DECORATOR_T:
             "information."
         )
 
-    def decorator(f: _VIEW_T) -> _VIEW_T:
-        @wraps(f)
-        def _wrapped(*a: Any, **kw: Any) -> HttpResponseBase:
-            resp = f(*a, **kw)
-            if REPORT_ONLY:
-                setattr(resp, "_csp_exempt_ro", True)
-            else:
-                setattr(resp, "_csp_exempt", True)
-            return resp
-
-        return _wrapped
-
-    return decorator
+    return _set_response_attr("_csp_exempt_ro" if REPORT_ONLY else "_csp_exempt", True)
 
 
 # Error message for deprecated decorator arguments.
@@ -46,59 +73,20 @@ def csp_update(config: dict[str, Any] | None = None, REPORT_ONLY: bool = False,
     if config is None and kwargs:
         raise RuntimeError(DECORATOR_DEPRECATION_ERROR.format(fname="csp_update"))
 
-    def decorator(f: _VIEW_T) -> _VIEW_T:
-        @wraps(f)
-        def _wrapped(*a: Any, **kw: Any) -> HttpResponseBase:
-            resp = f(*a, **kw)
-            if REPORT_ONLY:
-                setattr(resp, "_csp_update_ro", config)
-            else:
-                setattr(resp, "_csp_update", config)
-            return resp
-
-        return _wrapped
-
-    return decorator
+    policy = Policy(config) if config is not None else None
+    return _set_response_attr("_csp_update_ro" if REPORT_ONLY else "_csp_update", policy)
 
 
 def csp_replace(config: dict[str, Any] | None = None, REPORT_ONLY: bool = False, **kwargs: Any) -> _VIEW_DECORATOR_T:
     if config is None and kwargs:
         raise RuntimeError(DECORATOR_DEPRECATION_ERROR.format(fname="csp_replace"))
 
-    def decorator(f: _VIEW_T) -> _VIEW_T:
-        @wraps(f)
-        def _wrapped(*a: Any, **kw: Any) -> HttpResponseBase:
-            resp = f(*a, **kw)
-            if REPORT_ONLY:
-                setattr(resp, "_csp_replace_ro", config)
-            else:
-                setattr(resp, "_csp_replace", config)
-            return resp
-
-        return _wrapped
-
-    return decorator
+    policy = Policy(config) if config is not None else None
+    return _set_response_attr("_csp_replace_ro" if REPORT_ONLY else "_csp_replace", policy)
 
 
 def csp(config: dict[str, Any] | None = None, REPORT_ONLY: bool = False, **kwargs: Any) -> _VIEW_DECORATOR_T:
     if config is None and kwargs:
         raise RuntimeError(DECORATOR_DEPRECATION_ERROR.format(fname="csp"))
 
-    if config is None:
-        processed_config: dict[str, list[Any]] = {}
-    else:
-        processed_config = {k: [v] if isinstance(v, str) else v for k, v in config.items()}
-
-    def decorator(f: _VIEW_T) -> _VIEW_T:
-        @wraps(f)
-        def _wrapped(*a: Any, **kw: Any) -> HttpResponseBase:
-            resp = f(*a, **kw)
-            if REPORT_ONLY:
-                setattr(resp, "_csp_config_ro", processed_config)
-            else:
-                setattr(resp, "_csp_config", processed_config)
-            return resp
-
-        return _wrapped
-
-    return decorator
+    return _set_response_attr("_csp_config_ro" if REPORT_ONLY else "_csp_config", Policy(config))
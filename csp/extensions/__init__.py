@@ -5,7 +5,7 @@ from typing import TYPE_CHECKING, Any, Callable
 from jinja2 import nodes
 from jinja2.ext import Extension
 
-from csp.utils import SCRIPT_ATTRS, build_script_tag
+from csp.utils import SCRIPT_ATTRS, build_script_tag, constant_script_hash, script_hash_marker, use_script_hash
 
 if TYPE_CHECKING:
     from jinja2.parser import Parser
@@ -35,6 +35,11 @@ class NoncedScript(Extension):
         # drop the needle (which would always be `endscript` in that case)
         body = parser.parse_statements(("name:endscript",), drop_needle=True)
 
+        # The hash of a body without any tags or expressions is computed once, when compiling.
+        if all(isinstance(node, nodes.Output) and all(isinstance(child, nodes.TemplateData) for child in node.nodes) for node in body):
+            content = "".join(child.data for node in body for child in node.nodes)  # type: ignore[attr-defined]
+            kwargs.append(nodes.Keyword("script_hash", nodes.Const(constant_script_hash(content))))
+
         # now return a `CallBlock` node that calls our _render_script
         # helper method on this extension.
         return nodes.CallBlock(self.call_method("_render_script", kwargs=kwargs), [], [], body).set_lineno(lineno)
@@ -42,7 +47,14 @@ class NoncedScript(Extension):
     def _render_script(self, caller: Callable[[], str], **kwargs: Any) -> str:
         ctx = kwargs.pop("ctx")
         request = ctx.get("request")
-        kwargs["nonce"] = str(request.csp_nonce)
+        script_hash = kwargs.pop("script_hash", None)
+        marker = ""
+        if not kwargs.get("src") and use_script_hash(request, script_hash):
+            kwargs["nonce"] = ""
+            # The hash travels with the page, for responses replayed from a cache.
+            marker = script_hash_marker(script_hash)
+        else:
+            kwargs["nonce"] = str(request.csp_nonce)
         kwargs["content"] = caller().strip()
 
-        return build_script_tag(**kwargs)
+        return marker + build_script_tag(**kwargs)
@@ -0,0 +1,31 @@
+from __future__ import annotations
+
+import json
+from typing import TYPE_CHECKING, Any
+
+from django.core.management.base import BaseCommand
+
+from csp.utils import dump_compiled_policies
+
+if TYPE_CHECKING:
+    from argparse import ArgumentParser
+
+
+class Command(BaseCommand):
+    help = (
+        "Compiles the CSP policies from the settings and of every decorated view in the URLconf into a JSON file, "
+        "which CSPMiddleware loads at startup when CONTENT_SECURITY_POLICY_COMPILED_PATH is set."
+    )
+
+    def add_arguments(self, parser: ArgumentParser) -> None:
+        parser.add_argument("-o", "--output", help="The file to write the compiled policies to. Defaults to stdout.")
+        parser.add_argument("--urlconf", help="The URLconf to find decorated views in. Defaults to ROOT_URLCONF.")
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        compiled = json.dumps(dump_compiled_policies(options["urlconf"]), indent=2) + "\n"
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                f.write(compiled)
+            self.stdout.write(self.style.SUCCESS(f"Wrote the compiled CSP policies to {options['output']}."))
+        else:
+            self.stdout.write(compiled, ending="")
@@ -1,32 +1,114 @@
 from __future__ import annotations
 
-import base64
 import http.client as http_client
-import os
 import warnings
-from dataclasses import asdict, dataclass
-from functools import partial
-from typing import TYPE_CHECKING
+from time import perf_counter
+from typing import TYPE_CHECKING, Any
 
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse, StreamingHttpResponse
 from django.utils.deprecation import MiddlewareMixin
 from django.utils.functional import SimpleLazyObject, empty
 
 from csp.constants import HEADER, HEADER_REPORT_ONLY
-from csp.exceptions import CSPNonceError
-from csp.utils import DIRECTIVES_T, build_policy
+from csp.nonce import POST_RESPONSE_NONCE, LazyNonce, get_nonce_placeholder, get_nonce_source
+from csp.signals import Metrics, response_processed
+from csp.utils import (
+    DIRECTIVES_T,
+    build_policy,
+    find_script_hashes,
+    get_content_types,
+    get_excluded_url_matcher,
+    get_report_only_sampler,
+    get_reporting_endpoints_headers,
+    get_thread_compile_count,
+    load_compiled_policies,
+    precompile_policies,
+)
 
 if TYPE_CHECKING:
+    from collections.abc import AsyncIterator, Iterable, Iterator
+
     from django.http import HttpRequest, HttpResponseBase
 
 
-@dataclass
 class PolicyParts:
-    # A dataclass is used rather than a namedtuple so that the attributes are mutable
-    config: DIRECTIVES_T | None = None
-    update: DIRECTIVES_T | None = None
-    replace: DIRECTIVES_T | None = None
-    nonce: str | None = None
+    # A slotted class is used rather than a namedtuple so that the attributes are mutable, and
+    # rather than a dataclass so that the parts can be passed to `build_policy` without copying.
+    __slots__ = ("config", "update", "replace", "nonce", "hashes", "reporting")
+
+    def __init__(
+        self,
+        config: DIRECTIVES_T | None = None,
+        update: DIRECTIVES_T | None = None,
+        replace: DIRECTIVES_T | None = None,
+        nonce: str | None = None,
+        hashes: Iterable[str] | None = None,
+        reporting: bool = True,
+    ) -> None:
+        self.config = config
+        self.update = update
+        self.replace = replace
+        self.nonce = nonce
+        self.hashes = hashes
+        # Whether the policy keeps its `report-uri` and `report-to` directives.
+        self.reporting = reporting
+
+    def __repr__(self) -> str:
+        return (
+            f"PolicyParts(config={self.config!r}, update={self.update!r}, replace={self.replace!r}, "
+            f"nonce={self.nonce!r}, hashes={self.hashes!r}, reporting={self.reporting!r})"
+        )
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, PolicyParts):
+            return NotImplemented
+        return self.to_kwargs() == other.to_kwargs()
+
+    def to_kwargs(self) -> dict[str, Any]:
+        """Returns the parts as keyword arguments for `build_policy`, without copying them."""
+        return {
+            "config": self.config,
+            "update": self.update,
+            "replace": self.replace,
+            "nonce": self.nonce,
+            "hashes": self.hashes,
+            "reporting": self.reporting,
+        }
+
+
+def _replace_in_stream(response: StreamingHttpResponse, old: bytes, new: bytes) -> Iterator[bytes] | AsyncIterator[bytes]:
+    # The end of each chunk is held back until the next one, in case `old` spans both of them.
+    keep = len(old) - 1
+
+    def replace(chunk: bytes, tail: bytes) -> tuple[bytes, bytes]:
+        data = (tail + chunk).replace(old, new)
+        return data[:-keep], data[-keep:]
+
+    if response.is_async:
+
+        async def areplace(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+            tail = b""
+            async for chunk in chunks:
+                data, tail = replace(chunk, tail)
+                if data:
+                    yield data
+            if tail:
+                yield tail
+
+        return areplace(response.streaming_content)  # type: ignore[arg-type]
+
+    def sreplace(chunks: Iterator[bytes]) -> Iterator[bytes]:
+        tail = b""
+        for chunk in chunks:
+            data, tail = replace(chunk, tail)
+            if data:
+                yield data
+        if tail:
+            yield tail
+
+    return sreplace(response.streaming_content)  # type: ignore[arg-type]
 
 
 class CheckableLazyObject(SimpleLazyObject):
@@ -49,77 +131,235 @@ class CSPMiddleware(MiddlewareMixin):
     See http://www.w3.org/TR/CSP/
 
     Can be customised by subclassing and extending the get_policy_parts method.
+
+    Under ASGI the request and response are processed directly on the event loop. Subclasses
+    that need to do blocking I/O while building the policy should override `__acall__`.
     """
 
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response: Any) -> None:
+        super().__init__(get_response)
+        # The middleware is created once the app registry is ready, when the handler is loaded. With
+        # a preloading server, that's before workers are forked, so they all share the policies.
+        compiled_path = getattr(settings, "CONTENT_SECURITY_POLICY_COMPILED_PATH", None)
+        if compiled_path:
+            load_compiled_policies(compiled_path)
+        if getattr(settings, "CONTENT_SECURITY_POLICY_PRECOMPILE", False):
+            precompile_policies()
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponseBase:
+        # Unlike `MiddlewareMixin`, don't hop to a thread with `sync_to_async`. Building the
+        # policy doesn't do any I/O, so it's cheaper to do it on the event loop.
+        self.process_request(request)
+        metrics = getattr(request, "_csp_metrics", None)
+        if metrics is not None:
+            # Sending the signal synchronously on the event loop would fail with async receivers.
+            setattr(request, "_csp_async", True)
+        response = await self.get_response(request)  # type: ignore[misc]
+        response = self.process_response(request, response)
+        if metrics is not None:
+            if hasattr(response_processed, "asend"):
+                await response_processed.asend(type(self), request=request, response=response, metrics=metrics)
+            else:  # pragma: no cover
+                # Django < 5.0 doesn't support async receivers.
+                response_processed.send(type(self), request=request, response=response, metrics=metrics)
+        return response
+
     def _make_nonce(self, request: HttpRequest) -> str:
         # Ensure that any subsequent calls to request.csp_nonce return the same value
         stored_nonce = getattr(request, "_csp_nonce", None)
         if isinstance(stored_nonce, str):
             return stored_nonce
-        nonce = base64.b64encode(os.urandom(16)).decode("ascii")
+        metrics = getattr(request, "_csp_metrics", None)
+        if metrics is None:
+            nonce = get_nonce_source()()
+        else:
+            start = perf_counter()
+            nonce = get_nonce_source()()
+            metrics.nonce_time += perf_counter() - start
         setattr(request, "_csp_nonce", nonce)
         return nonce
 
-    @staticmethod
-    def _csp_nonce_post_response() -> None:
-        raise CSPNonceError(
-            "The 'csp_nonce' attribute is not available after the CSP header has been written. Consider adjusting your MIDDLEWARE order."
-        )
-
     def process_request(self, request: HttpRequest) -> None:
-        nonce = partial(self._make_nonce, request)
-        setattr(request, "csp_nonce", CheckableLazyObject(nonce))
+        server_timing = getattr(settings, "CONTENT_SECURITY_POLICY_SERVER_TIMING", False)
+        start = perf_counter() if server_timing else 0.0
+
+        # With a placeholder, the nonce is substituted into the response as it's processed.
+        setattr(request, "csp_nonce", get_nonce_placeholder() or LazyNonce(self, request))
+        # Metrics are only collected when something receives them. Checking the list of receivers
+        # first keeps this free of allocations when nothing is connected.
+        if response_processed.receivers and response_processed.has_listeners(type(self)):
+            setattr(request, "_csp_metrics", Metrics())
+
+        if server_timing:
+            setattr(request, "_csp_duration", perf_counter() - start)
+
+    def _replace_nonce_placeholder(self, request: HttpRequest, response: HttpResponseBase, placeholder: str) -> None:
+        # Responses replayed from a cache contain the placeholder without the view having run, so
+        # the body is checked rather than whether the nonce was read. A leaked placeholder would be
+        # turned into a valid nonce wherever it's injected, so it's never sent.
+        placeholder_bytes = placeholder.encode("ascii")
+        encoding = response.get("Content-Encoding")
+        if encoding and encoding != "identity":
+            # Decompressing every response to look for the placeholder would be too costly.
+            raise ImproperlyConfigured(
+                f"The CSP nonce placeholder can't be replaced in a response with 'Content-Encoding: {encoding}'. "
+                "List the middleware compressing responses before CSPMiddleware in MIDDLEWARE."
+            )
+
+        for header, value in response.items():
+            if placeholder in value:
+                response[header] = value.replace(placeholder, self._make_nonce(request))
+
+        if isinstance(response, StreamingHttpResponse):
+            if response.has_header("Content-Length"):
+                # The body must keep its length, so the placeholder is blanked rather than replaced.
+                replacement = b"-" * len(placeholder_bytes)
+            else:
+                replacement = self._make_nonce(request).encode("ascii")
+            response.streaming_content = _replace_in_stream(response, placeholder_bytes, replacement)
+            return
+
+        if not isinstance(response, HttpResponse):
+            return
+        content = response.content
+        if placeholder_bytes not in content:
+            return
+        nonce = self._make_nonce(request)
+        response.content = content.replace(placeholder_bytes, nonce.encode("ascii"))
+        if response.has_header("Content-Length"):
+            response["Content-Length"] = str(len(response.content))
 
     def process_response(self, request: HttpRequest, response: HttpResponseBase) -> HttpResponseBase:
+        request_duration = getattr(request, "_csp_duration", None)
+        if request_duration is None:
+            return self._process_response(request, response)
+
+        start = perf_counter()
+        response = self._process_response(request, response)
+        duration = request_duration + perf_counter() - start
+        # Merge with the metrics of other middleware, in milliseconds as the spec recommends.
+        server_timing = f"csp;dur={duration * 1000:.3f}"
+        existing = response.get("Server-Timing")
+        response["Server-Timing"] = f"{existing}, {server_timing}" if existing else server_timing
+        return response
+
+    def _process_response(self, request: HttpRequest, response: HttpResponseBase) -> HttpResponseBase:
+        # Always replace the placeholder, even in responses that don't get a header, so it's never sent.
+        placeholder = get_nonce_placeholder()
+        if placeholder is not None:
+            self._replace_nonce_placeholder(request, response, placeholder)
+
+        metrics = getattr(request, "_csp_metrics", None)
+
         # Check for debug view
         exempted_debug_codes = (
             http_client.INTERNAL_SERVER_ERROR,
             http_client.NOT_FOUND,
         )
         if response.status_code in exempted_debug_codes and settings.DEBUG:
+            if metrics is not None:
+                metrics.skipped.extend((("debug", False), ("debug", True)))
+                self._send_response_processed(request, response, metrics)
             return response
 
-        policy_parts = self.get_policy_parts(request=request, response=response)
-        csp = build_policy(**asdict(policy_parts))
-        if csp:
-            # Only set header if not already set and not an excluded prefix and not exempted.
-            is_not_exempt = getattr(response, "_csp_exempt", False) is False
-            no_header = HEADER not in response
-            policy = getattr(settings, "CONTENT_SECURITY_POLICY", None) or {}
-            prefixes = policy.get("EXCLUDE_URL_PREFIXES", None) or ()
-            is_not_excluded = not request.path_info.startswith(tuple(prefixes))
-            if no_header and is_not_exempt and is_not_excluded:
-                response[HEADER] = csp
+        # Whether a header was added with its reporting directives.
+        reporting = self._add_header(request, response, metrics)
+        reporting = self._add_header(request, response, metrics, report_only=True) or reporting
 
-        policy_parts_ro = self.get_policy_parts(request=request, response=response, report_only=True)
-        csp_ro = build_policy(**asdict(policy_parts_ro), report_only=True)
-        if csp_ro:
-            # Only set header if not already set and not an excluded prefix and not exempted.
-            is_not_exempt = getattr(response, "_csp_exempt_ro", False) is False
-            no_header = HEADER_REPORT_ONLY not in response
-            policy = getattr(settings, "CONTENT_SECURITY_POLICY_REPORT_ONLY", None) or {}
-            prefixes = policy.get("EXCLUDE_URL_PREFIXES", None) or ()
-            is_not_excluded = not request.path_info.startswith(tuple(prefixes))
-            if no_header and is_not_exempt and is_not_excluded:
-                response[HEADER_REPORT_ONLY] = csp_ro
+        if reporting:
+            for header, value in get_reporting_endpoints_headers():
+                if header not in response:
+                    response[header] = value
 
         # Once we've written the header, accessing the `request.csp_nonce` will no longer trigger
         # the nonce to be added to the header. Instead we throw an error here to catch this since
         # this has security implications.
         if getattr(request, "_csp_nonce", None) is None:
-            setattr(request, "csp_nonce", CheckableLazyObject(self._csp_nonce_post_response))
+            setattr(request, "csp_nonce", POST_RESPONSE_NONCE)
 
+        if metrics is not None:
+            self._send_response_processed(request, response, metrics)
         return response
 
+    def _send_response_processed(self, request: HttpRequest, response: HttpResponseBase, metrics: Metrics) -> None:
+        # Under ASGI, `__acall__` sends the signal itself once the response is processed.
+        if getattr(request, "_csp_async", False):
+            return
+        response_processed.send(type(self), request=request, response=response, metrics=metrics)
+
+    def _add_header(self, request: HttpRequest, response: HttpResponseBase, metrics: Metrics | None, report_only: bool = False) -> bool:
+        # Returns whether the header was added with its reporting directives. The steps are only
+        # timed when something receives the metrics.
+        # Run the cheap checks first so no policy is built for responses that won't get the header.
+        skip_reason = self._skip_reason(request, response, report_only)
+        if skip_reason is not None:
+            if metrics is not None:
+                metrics.skipped.append((skip_reason, report_only))
+            return False
+
+        if metrics is not None:
+            compile_count = get_thread_compile_count()
+            start = perf_counter()
+        policy_parts = self.get_policy_parts(request=request, response=response, report_only=report_only)
+        csp = build_policy(**policy_parts.to_kwargs(), report_only=report_only)
+        if metrics is not None:
+            metrics.build_time += perf_counter() - start
+            # Policies are compiled by the thread missing the caches.
+            if get_thread_compile_count() == compile_count:
+                metrics.cache_hits += 1
+            else:
+                metrics.cache_misses += 1
+
+        if not csp:
+            return False
+        if metrics is None:
+            response[HEADER_REPORT_ONLY if report_only else HEADER] = csp
+        else:
+            start = perf_counter()
+            response[HEADER_REPORT_ONLY if report_only else HEADER] = csp
+            metrics.header_time += perf_counter() - start
+        return policy_parts.reporting
+
+    def _should_add_header(self, request: HttpRequest, response: HttpResponseBase, report_only: bool = False) -> bool:
+        return self._skip_reason(request, response, report_only) is None
+
+    def _skip_reason(self, request: HttpRequest, response: HttpResponseBase, report_only: bool = False) -> str | None:
+        # Only set header if not already set, not exempted, of a matching content type and not an excluded prefix.
+        if report_only:
+            is_exempt = getattr(response, "_csp_exempt_ro", False) is not False
+            has_header = HEADER_REPORT_ONLY in response
+        else:
+            is_exempt = getattr(response, "_csp_exempt", False) is not False
+            has_header = HEADER in response
+        if is_exempt:
+            return "exempt"
+        if has_header:
+            return "header_exists"
+        content_types = get_content_types(report_only)
+        if content_types is not None:
+            content_type = response.get("Content-Type", "").partition(";")[0].strip().lower()
+            if content_type not in content_types:
+                return "content_type"
+        if get_excluded_url_matcher(report_only).matches(request.path_info):
+            return "excluded_url"
+        if report_only:
+            sampler = get_report_only_sampler()
+            if sampler is not None and not sampler(request):
+                return "unsampled"
+        return None
+
     def build_policy(self, request: HttpRequest, response: HttpResponseBase) -> str:
         warnings.warn("deprecated in favor of get_policy_parts", DeprecationWarning)
         policy_parts = self.get_policy_parts(request=request, response=response, report_only=False)
-        return build_policy(**asdict(policy_parts))
+        return build_policy(**policy_parts.to_kwargs())
 
     def build_policy_ro(self, request: HttpRequest, response: HttpResponseBase) -> str:
         warnings.warn("deprecated in favor of get_policy_parts", DeprecationWarning)
         policy_parts_ro = self.get_policy_parts(request=request, response=response, report_only=True)
-        return build_policy(**asdict(policy_parts_ro), report_only=True)
+        return build_policy(**policy_parts_ro.to_kwargs(), report_only=True)
 
     def get_policy_parts(
         self,
@@ -137,5 +377,17 @@ class CSPMiddleware(MiddlewareMixin):
             replace = getattr(response, "_csp_replace", None)
 
         nonce = getattr(request, "_csp_nonce", None)
+        hashes = getattr(request, "_csp_hashes", None)
+        if (
+            isinstance(response, HttpResponse)
+            and getattr(settings, "CONTENT_SECURITY_POLICY_SCRIPT_HASHES", False)
+            and not getattr(request, "_csp_hashes_searched", False)
+        ):
+            # Parts of the body may have been rendered by other requests, e.g. a page replayed from a
+            # cache or a `{% cache %}` fragment, so the hashes in its markers are added to the
+            # request's. The body is only searched once for both policies.
+            hashes = find_script_hashes(response.content, hashes)
+            setattr(request, "_csp_hashes", hashes)
+            setattr(request, "_csp_hashes_searched", True)
 
-        return PolicyParts(config, update, replace, nonce)
+        return PolicyParts(config, update, replace, nonce, hashes)
@@ -0,0 +1,207 @@
+from __future__ import annotations
+
+import base64
+import os
+import threading
+from collections.abc import Iterator
+from typing import TYPE_CHECKING, Any, Callable
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.crypto import salted_hmac
+from django.utils.module_loading import import_string
+
+from csp.exceptions import CSPNonceError
+
+if TYPE_CHECKING:
+    from django.http import HttpRequest
+
+    from csp.middleware import CSPMiddleware
+
+NONCE_BYTES = 16
+
+
+def random_nonce() -> str:
+    """Returns a nonce from a single `os.urandom` call."""
+    return base64.b64encode(os.urandom(NONCE_BYTES)).decode("ascii")
+
+
+class NoncePool:
+    """
+    A nonce source that reads entropy for `size` nonces with a single `os.urandom` call, and
+    encodes a slice of it for each nonce up front.
+
+    Each thread has its own buffer, so no locking is needed. Buffers are discarded in forked
+    child processes, so worker processes never hand out the same nonces as their siblings.
+    """
+
+    def __init__(self, size: int = 256) -> None:
+        self.size = size
+        self._local = threading.local()
+        # Incremented in forked children, invalidating buffers inherited from the parent.
+        self._generation = 0
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self) -> None:
+        self._generation += 1
+
+    def _fill(self) -> list[str]:
+        block = os.urandom(NONCE_BYTES * self.size)
+        nonces = [base64.b64encode(block[i : i + NONCE_BYTES]).decode("ascii") for i in range(0, len(block), NONCE_BYTES)]
+        self._local.nonces = nonces
+        self._local.generation = self._generation
+        return nonces
+
+    def __call__(self) -> str:
+        local = self._local
+        nonces = getattr(local, "nonces", None)
+        if not nonces or local.generation != self._generation:
+            nonces = self._fill()
+        return nonces.pop()
+
+
+pooled_nonce = NoncePool()
+
+_nonce_source: list[Callable[[], str]] = []
+
+
+_nonce_placeholder: list[str | None] = []
+
+
+@receiver(setting_changed)
+def _clear_nonce_source(*, setting: str, **kwargs: Any) -> None:
+    if setting == "CONTENT_SECURITY_POLICY_NONCE_SOURCE":
+        _nonce_source.clear()
+    elif setting in ("CONTENT_SECURITY_POLICY_NONCE_PLACEHOLDER", "SECRET_KEY"):
+        _nonce_placeholder.clear()
+
+
+def get_nonce_source() -> Callable[[], str]:
+    """
+    Returns the callable generating nonces, from the ``CONTENT_SECURITY_POLICY_NONCE_SOURCE``
+    setting. The setting may be a callable or a dotted path to one, and defaults to `random_nonce`.
+    """
+    if not _nonce_source:
+        source = getattr(settings, "CONTENT_SECURITY_POLICY_NONCE_SOURCE", None) or random_nonce
+        if isinstance(source, str):
+            source = import_string(source)
+        _nonce_source.append(source)
+    return _nonce_source[0]
+
+
+def get_nonce_placeholder() -> str | None:
+    """
+    Returns the token used in place of the nonce when ``CONTENT_SECURITY_POLICY_NONCE_PLACEHOLDER``
+    is enabled, or None.
+
+    The token is derived from ``SECRET_KEY``, so it's the same in every process sharing a cache but
+    can't be guessed and injected into a page to have it replaced by the nonce.
+    """
+    if not _nonce_placeholder:
+        if getattr(settings, "CONTENT_SECURITY_POLICY_NONCE_PLACEHOLDER", False):
+            digest = salted_hmac("csp.nonce.get_nonce_placeholder", "placeholder").hexdigest()
+            _nonce_placeholder.append(f"csp-nonce-{digest[:32]}")
+        else:
+            _nonce_placeholder.append(None)
+    return _nonce_placeholder[0]
+
+
+class LazyNonce:
+    """
+    The nonce of a request, generated by the middleware the first time it is read.
+
+    `bool(nonce)` is True once the nonce has been generated, and never generates it. This is a
+    slotted replacement for `CheckableLazyObject`, which needs a `partial` and an instance
+    `__dict__` for every request.
+    """
+
+    __slots__ = ("_middleware", "_request", "_value")
+
+    def __init__(self, middleware: CSPMiddleware | None, request: HttpRequest | None) -> None:
+        self._middleware = middleware
+        self._request = request
+        self._value: str | None = None
+
+    def _get(self) -> str:
+        if self._value is None:
+            assert self._middleware is not None and self._request is not None
+            self._value = self._middleware._make_nonce(self._request)
+        return self._value
+
+    def __bool__(self) -> bool:
+        return self._value is not None
+
+    def __str__(self) -> str:
+        return self._get()
+
+    def __repr__(self) -> str:
+        if self._value is None:
+            return f"<{type(self).__name__}: not generated>"
+        return f"<{type(self).__name__}: {self._value!r}>"
+
+    def __format__(self, format_spec: str) -> str:
+        return format(self._get(), format_spec)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, LazyNonce):
+            other = other._get()
+        return self._get() == other
+
+    def __lt__(self, other: str) -> bool:
+        return self._get() < str(other)
+
+    def __le__(self, other: str) -> bool:
+        return self._get() <= str(other)
+
+    def __gt__(self, other: str) -> bool:
+        return self._get() > str(other)
+
+    def __ge__(self, other: str) -> bool:
+        return self._get() >= str(other)
+
+    def __hash__(self) -> int:
+        return hash(self._get())
+
+    def __len__(self) -> int:
+        return len(self._get())
+
+    def __getitem__(self, key: int | slice) -> str:
+        return self._get()[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._get())
+
+    def __contains__(self, item: str) -> bool:
+        return item in self._get()
+
+    def __add__(self, other: str) -> str:
+        return self._get() + other
+
+    def __radd__(self, other: str) -> str:
+        return other + self._get()
+
+    def __getattr__(self, name: str) -> Any:
+        # Proxy string methods, without generating the nonce for protocol lookups like `__html__`.
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self._get(), name)
+
+
+class _PostResponseNonce(LazyNonce):
+    """
+    Replaces an unused nonce once the header has been written, since a nonce generated after that
+    would be missing from the header.
+    """
+
+    __slots__ = ()
+
+    def _get(self) -> str:
+        raise CSPNonceError(
+            "The 'csp_nonce' attribute is not available after the CSP header has been written. Consider adjusting your MIDDLEWARE order."
+        )
+
+
+# A single instance is shared by all requests, as it holds no per-request state.
+POST_RESPONSE_NONCE = _PostResponseNonce(None, None)
@@ -0,0 +1,345 @@
+from __future__ import annotations
+
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger("csp.reports")
+
+REPORT_T = dict[str, Any]
+SINK_T = Callable[[list[REPORT_T]], None]
+
+DEFAULT_REPORTS_CONFIG: dict[str, Any] = {
+    # A callable, or dotted path to one, receiving batches of reports.
+    "SINK": "csp.reports.log_reports",
+    # The most reports waiting to be sent to the sink. Reports beyond that are dropped.
+    "QUEUE_SIZE": 10_000,
+    # The most reports sent to the sink at once.
+    "BATCH_SIZE": 100,
+    # The longest a report waits for a batch to fill, in seconds.
+    "FLUSH_INTERVAL": 1.0,
+    # The largest request body accepted by the view, in bytes.
+    "MAX_BODY_SIZE": 64 * 1024,
+    # Options for a `ReportAggregator` in front of the sink, or None to send every report.
+    "AGGREGATE": None,
+}
+
+# The keys of the Reporting API's `csp-violation` reports, and the equivalent `report-uri` keys.
+REPORTING_API_KEYS = {
+    "documentURL": "document-uri",
+    "referrer": "referrer",
+    "blockedURL": "blocked-uri",
+    "effectiveDirective": "effective-directive",
+    "originalPolicy": "original-policy",
+    "sourceFile": "source-file",
+    "sample": "script-sample",
+    "disposition": "disposition",
+    "statusCode": "status-code",
+    "lineNumber": "line-number",
+    "columnNumber": "column-number",
+}
+
+
+def log_reports(reports: list[REPORT_T]) -> None:
+    """The default sink, logging each report to the ``csp.reports`` logger."""
+    for report in reports:
+        logger.warning("CSP violation: %s", json.dumps(report, sort_keys=True))
+
+
+def parse_reports(data: Any) -> list[REPORT_T]:
+    """
+    Returns the violation reports from a decoded ``report-uri`` or Reporting API request body, with
+    Reporting API keys translated to their ``report-uri`` equivalents. Raises ValueError if the
+    body isn't a report.
+    """
+    if isinstance(data, dict):
+        report = data.get("csp-report")
+        if not isinstance(report, dict):
+            raise ValueError("Expected a 'csp-report' object.")
+        return [report]
+
+    if isinstance(data, list):
+        reports = []
+        for item in data:
+            if not isinstance(item, dict) or not isinstance(item.get("body"), dict):
+                raise ValueError("Expected Reporting API reports with a 'body' object.")
+            # The Reporting API batches all kinds of reports to the same endpoint.
+            if item.get("type") != "csp-violation":
+                continue
+            report = {REPORTING_API_KEYS.get(k, k): v for k, v in item["body"].items()}
+            report.setdefault("violated-directive", report.get("effective-directive"))
+            reports.append(report)
+        return reports
+
+    raise ValueError("Expected a report object or a list of Reporting API reports.")
+
+
+# The fields identifying duplicate reports.
+AGGREGATE_KEY_FIELDS = ("blocked-uri", "violated-directive", "document-uri")
+
+
+class _Aggregate:
+    __slots__ = ("key", "count", "first_seen", "last_seen", "sample")
+
+    def __init__(self, key: tuple[str, ...], now: float, sample: REPORT_T) -> None:
+        self.key = key
+        self.count = 1
+        self.first_seen = now
+        self.last_seen = now
+        self.sample = sample
+
+    def to_dict(self) -> REPORT_T:
+        return {
+            "key": dict(zip(AGGREGATE_KEY_FIELDS, self.key)),
+            "count": self.count,
+            "first-seen": self.first_seen,
+            "last-seen": self.last_seen,
+            "sample": self.sample,
+        }
+
+
+class ReportAggregator:
+    """
+    A sink collapsing duplicate reports before passing them on to another sink.
+
+    Reports with the same blocked URI, violated directive and document URI are counted together
+    for `window` seconds from the first of them, then sent to `sink` as a single record::
+
+        {"key": {...}, "count": 3, "first-seen": ..., "last-seen": ..., "sample": {...}}
+
+    where `sample` is the first report, and the times are Unix timestamps. At most `max_keys`
+    records are held: beyond that the least recently seen record is sent early, so memory is
+    bounded by the number of distinct violations rather than the number of reports.
+    """
+
+    def __init__(self, sink: SINK_T, window: float = 60.0, max_keys: int = 10_000) -> None:
+        self.sink = sink
+        self.window = window
+        self.max_keys = max_keys
+        # Ordered by when the records were last seen, for eviction.
+        self._aggregates: OrderedDict[tuple[str, ...], _Aggregate] = OrderedDict()
+        # Ordered by when the records were first seen, for expiry. May hold records already evicted.
+        self._by_first_seen: deque[_Aggregate] = deque()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_key(report: REPORT_T) -> tuple[str, ...]:
+        directive = report.get("violated-directive") or report.get("effective-directive")
+        return (str(report.get("blocked-uri", "")), str(directive or ""), str(report.get("document-uri", "")))
+
+    def __call__(self, reports: list[REPORT_T]) -> None:
+        now = time.time()
+        ready = []
+        with self._lock:
+            aggregates = self._aggregates
+            for report in reports:
+                key = self.get_key(report)
+                aggregate = aggregates.get(key)
+                if aggregate is None:
+                    aggregate = aggregates[key] = _Aggregate(key, now, report)
+                    self._by_first_seen.append(aggregate)
+                    if len(aggregates) > self.max_keys:
+                        ready.append(aggregates.popitem(last=False)[1])
+                        if len(self._by_first_seen) > 2 * self.max_keys:
+                            self._by_first_seen = deque(a for a in self._by_first_seen if aggregates.get(a.key) is a)
+                else:
+                    aggregate.count += 1
+                    aggregate.last_seen = now
+                    aggregates.move_to_end(key)
+            ready.extend(self._pop_expired(now))
+        self._send(ready)
+
+    def _pop_expired(self, now: float) -> list[_Aggregate]:
+        expired = []
+        by_first_seen = self._by_first_seen
+        while by_first_seen and now - by_first_seen[0].first_seen >= self.window:
+            aggregate = by_first_seen.popleft()
+            if self._aggregates.get(aggregate.key) is aggregate:
+                del self._aggregates[aggregate.key]
+                expired.append(aggregate)
+        return expired
+
+    def flush(self, force: bool = False) -> None:
+        """Sends the records whose window has ended, or all of them if `force` is True."""
+        with self._lock:
+            if force:
+                ready = list(self._aggregates.values())
+                self._aggregates.clear()
+                self._by_first_seen.clear()
+            else:
+                ready = self._pop_expired(time.time())
+        self._send(ready)
+
+    def _send(self, aggregates: list[_Aggregate]) -> None:
+        if aggregates:
+            self.sink([aggregate.to_dict() for aggregate in aggregates])
+
+
+# Marks the end of the reports, when a queue is closed.
+_STOP: Any = object()
+
+
+class ReportQueue:
+    """
+    A bounded queue of violation reports, sent to a sink in batches by a background thread.
+
+    Adding a report never blocks: when the queue is full the report is dropped and counted in
+    `dropped`. Reports lost to exceptions raised by the sink are counted in `failed`.
+
+    If the sink has a `flush` method, like `ReportAggregator`, it's called whenever no report
+    arrives for `flush_interval` seconds, and with `force=True` when the queue is closed.
+    """
+
+    def __init__(self, sink: SINK_T, maxsize: int = 10_000, batch_size: int = 100, flush_interval: float = 1.0) -> None:
+        self.sink = sink
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self.failed = 0
+        self._queue: queue.Queue[REPORT_T] = queue.Queue(maxsize)
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._pid = os.getpid()
+
+    def put(self, report: REPORT_T) -> bool:
+        """Adds a report to the queue, returning False if it was dropped."""
+        if self._thread is None or self._pid != os.getpid():
+            self._start()
+        try:
+            self._queue.put_nowait(report)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        return True
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._pid != os.getpid():
+                # Threads don't survive a fork, and the reports queued by the parent are its own to send.
+                self._queue = queue.Queue(self._queue.maxsize)
+                self._thread = None
+                self._pid = os.getpid()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, args=(self._queue,), name="csp-reports", daemon=True)
+                self._thread.start()
+
+    def _run(self, reports: queue.Queue[REPORT_T]) -> None:
+        idle_timeout = self.flush_interval if hasattr(self.sink, "flush") else None
+        while True:
+            try:
+                report = reports.get(timeout=idle_timeout)
+            except queue.Empty:
+                self._flush_sink()
+                continue
+            if report is _STOP:
+                return
+            batch = [report]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    report = reports.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if report is _STOP:
+                    self._send(batch)
+                    return
+                batch.append(report)
+            self._send(batch)
+
+    def _send(self, batch: list[REPORT_T]) -> None:
+        try:
+            self.sink(batch)
+        except Exception:
+            logger.exception("Failed to send %d CSP violation reports.", len(batch))
+            with self._lock:
+                self.failed += len(batch)
+
+    def _flush_sink(self, force: bool = False) -> None:
+        sink_flush = getattr(self.sink, "flush", None)
+        if sink_flush is None:
+            return
+        try:
+            sink_flush(force=force)
+        except Exception:
+            logger.exception("Failed to flush the CSP violation report sink.")
+
+    def flush(self) -> None:
+        """Sends the queued reports to the sink from the calling thread."""
+        batch: list[REPORT_T] = []
+        while True:
+            try:
+                report = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if report is not _STOP:
+                batch.append(report)
+            if len(batch) >= self.batch_size:
+                self._send(batch)
+                batch = []
+        if batch:
+            self._send(batch)
+
+    def close(self) -> None:
+        """Sends the queued reports to the sink, and stops the background thread."""
+        self.flush()
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and self._pid == os.getpid():
+            self._queue.put(_STOP)
+            thread.join()
+        self._flush_sink(force=True)
+
+
+_report_queue: list[ReportQueue] = []
+_reports_config: list[dict[str, Any]] = []
+
+
+@receiver(setting_changed)
+def _clear_report_queue(*, setting: str, **kwargs: Any) -> None:
+    if setting == "CONTENT_SECURITY_POLICY_REPORTS":
+        _reports_config.clear()
+        if _report_queue:
+            _report_queue.pop().close()
+
+
+@atexit.register
+def _close_report_queue() -> None:
+    # The queue's thread is a daemon, so the reports still queued would be lost when the process
+    # exits. A forked process that never queued a report holds a copy of its parent's queue.
+    if _report_queue and _report_queue[0]._pid == os.getpid():
+        _report_queue[0].close()
+
+
+def get_reports_config() -> dict[str, Any]:
+    """Returns the ``CONTENT_SECURITY_POLICY_REPORTS`` setting, merged with the defaults."""
+    if not _reports_config:
+        _reports_config.append({**DEFAULT_REPORTS_CONFIG, **getattr(settings, "CONTENT_SECURITY_POLICY_REPORTS", {})})
+    return _reports_config[0]
+
+
+def get_report_queue() -> ReportQueue:
+    """Returns the process's queue of reports, created from the settings when first used."""
+    if not _report_queue:
+        config = get_reports_config()
+        sink = config["SINK"]
+        if isinstance(sink, str):
+            sink = import_string(sink)
+        if config["AGGREGATE"] is not None:
+            sink = ReportAggregator(sink, **{k.lower(): v for k, v in config["AGGREGATE"].items()})
+        _report_queue.append(ReportQueue(sink, config["QUEUE_SIZE"], config["BATCH_SIZE"], config["FLUSH_INTERVAL"]))
+    return _report_queue[0]
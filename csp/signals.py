@@ -0,0 +1,34 @@
+from __future__ import annotations
+
+from django.dispatch import Signal
+
+# Sent by `CSPMiddleware` once it has processed a response, only when it has receivers, with the
+# `request`, the `response` and the `Metrics` of processing it as `metrics`. The sender is the
+# middleware class. The receivers are cached per sender, so checking for them doesn't take a lock.
+response_processed = Signal(use_caching=True)
+
+
+class Metrics:
+    """
+    Timings, in seconds, and counters of `CSPMiddleware` processing a response.
+
+    ``skipped`` lists the reason a header wasn't added, with whether it's the report-only header:
+    ``"debug"``, ``"exempt"``, ``"header_exists"``, ``"content_type"``, ``"excluded_url"`` or
+    ``"unsampled"``.
+    """
+
+    __slots__ = ("nonce_time", "build_time", "header_time", "cache_hits", "cache_misses", "skipped")
+
+    def __init__(self) -> None:
+        self.nonce_time = 0.0
+        self.build_time = 0.0
+        self.header_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.skipped: list[tuple[str, bool]] = []
+
+    def __repr__(self) -> str:
+        return (
+            f"Metrics(nonce_time={self.nonce_time!r}, build_time={self.build_time!r}, header_time={self.header_time!r}, "
+            f"cache_hits={self.cache_hits!r}, cache_misses={self.cache_misses!r}, skipped={self.skipped!r})"
+        )
@@ -3,9 +3,9 @@ from __future__ import annotations
 from typing import TYPE_CHECKING
 
 from django import template
-from django.template.base import token_kwargs
+from django.template.base import TextNode, token_kwargs
 
-from csp.utils import build_script_tag
+from csp.utils import build_script_tag, constant_script_hash, script_hash_marker, use_script_hash
 
 if TYPE_CHECKING:
     from django.template.base import FilterExpression, NodeList, Parser, Token
@@ -37,6 +37,11 @@ class NonceScriptNode(template.Node):
         self.script_attrs = {}
         for k, v in kwargs.items():
             self.script_attrs[k] = self._get_token_value(v)
+        # The hash of a body without any tags or variables is computed once, when parsing.
+        self.script_hash = None
+        text_nodes = [node for node in nodelist if isinstance(node, TextNode)]
+        if len(text_nodes) == len(nodelist):
+            self.script_hash = constant_script_hash("".join(node.s for node in text_nodes))
 
     def _get_token_value(self, t: FilterExpression) -> str | None:
         if hasattr(t, "token") and t.token:
@@ -46,7 +51,13 @@ class NonceScriptNode(template.Node):
     def render(self, context: Context) -> str:
         output = self.nodelist.render(context).strip()
         request = context.get("request")
-        nonce = str(getattr(request, "csp_nonce", ""))
+        marker = ""
+        if not self.script_attrs.get("src") and self.script_hash is not None and use_script_hash(request, self.script_hash):
+            nonce = ""
+            # The hash travels with the page, for responses replayed from a cache.
+            marker = script_hash_marker(self.script_hash)
+        else:
+            nonce = str(getattr(request, "csp_nonce", ""))
         self.script_attrs.update({"nonce": nonce, "content": output})
 
-        return build_script_tag(**self.script_attrs)
+        return marker + build_script_tag(**self.script_attrs)
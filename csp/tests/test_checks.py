@@ -1,6 +1,14 @@
 from django.test.utils import override_settings
 
-from csp.checks import check_django_csp_lt_4_0, check_exclude_url_prefixes_is_not_string, migrate_settings
+import pytest
+
+from csp.checks import (
+    check_content_types_is_not_string,
+    check_django_csp_lt_4_0,
+    check_exclude_url_prefixes_is_not_string,
+    check_report_only_sampling,
+    migrate_settings,
+)
 from csp.constants import NONCE
 
 
@@ -72,3 +80,35 @@ def test_check_exclude_url_prefixes_ro_is_not_string() -> None:
     error = errors[0]
     assert error.id == "csp.E002"
     assert error.msg == "EXCLUDE_URL_PREFIXES in CONTENT_SECURITY_POLICY_REPORT_ONLY settings must be a list or tuple."
+
+
+@override_settings(
+    CONTENT_SECURITY_POLICY={"CONTENT_TYPES": "text/html"},
+    CONTENT_SECURITY_POLICY_REPORT_ONLY={"CONTENT_TYPES": ["text/html"]},
+)
+def test_check_content_types_is_not_string() -> None:
+    errors = check_content_types_is_not_string(None)
+    assert len(errors) == 1
+    error = errors[0]
+    assert error.id == "csp.E003"
+    assert error.msg == "CONTENT_TYPES in CONTENT_SECURITY_POLICY settings must be a list or tuple."
+
+
+@override_settings(CONTENT_SECURITY_POLICY_REPORT_ONLY={"SAMPLE_PERCENTAGE": 10})
+def test_check_report_only_sampling_requires_key() -> None:
+    errors = check_report_only_sampling(None)
+    assert [error.id for error in errors] == ["csp.E004"]
+    assert errors[0].msg == "SAMPLE_PERCENTAGE in CONTENT_SECURITY_POLICY_REPORT_ONLY settings requires a SAMPLE_KEY."
+
+
+@pytest.mark.parametrize("percentage", [-1, 100.5, "10", True])
+def test_check_report_only_sampling_percentage(percentage: object) -> None:
+    with override_settings(CONTENT_SECURITY_POLICY_REPORT_ONLY={"SAMPLE_PERCENTAGE": percentage, "SAMPLE_KEY": "user.pk"}):
+        errors = check_report_only_sampling(None)
+    assert [error.id for error in errors] == ["csp.E005"]
+
+
+@pytest.mark.parametrize("percentage", [None, 0, 12.5, 100])
+def test_check_report_only_sampling_ok(percentage: object) -> None:
+    with override_settings(CONTENT_SECURITY_POLICY_REPORT_ONLY={"SAMPLE_PERCENTAGE": percentage, "SAMPLE_KEY": "user.pk"}):
+        assert check_report_only_sampling(None) == []
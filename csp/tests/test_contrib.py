@@ -1,10 +1,26 @@
+from __future__ import annotations
+
+import asyncio
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING
+from unittest import mock
+
 from django.http import HttpResponse
 from django.test import RequestFactory
 from django.test.utils import override_settings
 
-from csp.constants import HEADER, HEADER_REPORT_ONLY
-from csp.contrib.rate_limiting import RateLimitedCSPMiddleware
+import pytest
+from asgiref.sync import iscoroutinefunction
+
+from csp.constants import HEADER, HEADER_REPORT_ONLY, HEADER_REPORTING_ENDPOINTS
+from csp.contrib.rate_limiting import RateLimitedCSPMiddleware, SharedTokenBucket, TokenBucket, get_report_bucket
+from csp.decorators import csp_replace
 from csp.tests.utils import response
+from csp.utils import get_compile_count
+
+if TYPE_CHECKING:
+    from django.http import HttpRequest, HttpResponseBase
 
 mw = RateLimitedCSPMiddleware(response())
 rf = RequestFactory()
@@ -67,6 +83,19 @@ def test_report_percentage_report_only() -> None:
     assert 400 <= times_seen <= 600
 
 
+@override_settings(CONTENT_SECURITY_POLICY={"REPORT_PERCENTAGE": 0, "DIRECTIVES": {"report-uri": "x"}})
+def test_report_percentage_decorator_replace_not_mutated() -> None:
+    @csp_replace({"img-src": ["foo.com"]})
+    def view(request: HttpRequest) -> HttpResponseBase:
+        return HttpResponse()
+
+    request = rf.get("/")
+    response = view(request)
+    mw.process_response(request, response)
+    assert "report-uri" not in response[HEADER]
+    assert getattr(response, "_csp_replace") == {"img-src": ["foo.com"]}
+
+
 @override_settings(CONTENT_SECURITY_POLICY=None)
 def test_no_csp() -> None:
     request = rf.get("/")
@@ -81,3 +110,168 @@ def test_no_csp_ro() -> None:
     response = HttpResponse()
     mw.process_response(request, response)
     assert HEADER_REPORT_ONLY not in response
+
+
+def test_token_bucket() -> None:
+    with mock.patch("csp.contrib.rate_limiting.time.monotonic", return_value=100.0) as monotonic:
+        bucket = TokenBucket(rate=2, burst=3)
+        assert [bucket.take() for _ in range(4)] == [True, True, True, False]
+        monotonic.return_value = 100.5
+        assert [bucket.take() for _ in range(2)] == [True, False]
+        # Never refills beyond the burst.
+        monotonic.return_value = 200.0
+        assert [bucket.take() for _ in range(4)] == [True, True, True, False]
+
+
+def test_token_bucket_default_burst() -> None:
+    assert TokenBucket(rate=0.1).burst == 1.0
+    assert TokenBucket(rate=50).burst == 50
+
+
+@pytest.mark.skipif(os.name != "posix", reason="requires fcntl")
+def test_shared_token_bucket(tmp_path: Path) -> None:
+    path = str(tmp_path / "bucket")
+    with mock.patch("csp.contrib.rate_limiting.time.monotonic", return_value=100.0) as monotonic:
+        first = SharedTokenBucket(path, rate=1, burst=2)
+        second = SharedTokenBucket(path, rate=1, burst=2)
+        assert [first.take(), second.take(), first.take()] == [True, True, False]
+        monotonic.return_value = 101.0
+        assert [second.take(), first.take()] == [True, False]
+        # A clock behind the file's, e.g. after a reboot, refills the bucket.
+        monotonic.return_value = 1.0
+        assert [first.take(), second.take(), first.take()] == [True, True, False]
+
+
+@pytest.mark.skipif(os.name != "posix", reason="requires fcntl")
+def test_shared_token_bucket_closed_on_settings_change(tmp_path: Path) -> None:
+    with override_settings(CONTENT_SECURITY_POLICY={"REPORT_RATE_LIMIT": 1, "REPORT_RATE_LIMIT_FILE": str(tmp_path / "bucket")}):
+        bucket = get_report_bucket()
+        assert isinstance(bucket, SharedTokenBucket)
+        fd = bucket._fd
+        os.fstat(fd)
+    with pytest.raises(OSError):
+        os.fstat(fd)
+
+
+@pytest.mark.skipif(os.name != "posix", reason="requires fcntl")
+def test_shared_token_bucket_off_the_event_loop(tmp_path: Path) -> None:
+    on_event_loop = []
+
+    def take(self: SharedTokenBucket) -> bool:
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            on_event_loop.append(False)
+        else:
+            on_event_loop.append(True)
+        return True
+
+    async def get_response(request: HttpRequest) -> HttpResponseBase:
+        return HttpResponse()
+
+    async_mw = RateLimitedCSPMiddleware(get_response)
+    assert iscoroutinefunction(async_mw)
+    policy = {"REPORT_RATE_LIMIT": 1, "DIRECTIVES": {"report-uri": "x"}}
+    with mock.patch.object(SharedTokenBucket, "take", take), mock.patch.object(TokenBucket, "take", take):
+        with override_settings(CONTENT_SECURITY_POLICY={**policy, "REPORT_RATE_LIMIT_FILE": str(tmp_path / "bucket")}):
+            assert "report-uri x" in asyncio.run(async_mw(rf.get("/")))[HEADER]
+        # A bucket without a file doesn't block, so the response is processed on the event loop.
+        with override_settings(CONTENT_SECURITY_POLICY=policy):
+            asyncio.run(async_mw(rf.get("/")))
+    assert on_event_loop == [False, True]
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires os.fork")
+def test_shared_token_bucket_across_processes(tmp_path: Path) -> None:
+    bucket = SharedTokenBucket(str(tmp_path / "bucket"), rate=0.001, burst=10)
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:  # pragma: no cover
+        os.close(read_fd)
+        os.write(write_fd, bytes([sum(bucket.take() for _ in range(8))]))
+        os._exit(0)
+    os.close(write_fd)
+    with os.fdopen(read_fd, "rb") as f:
+        child_taken = f.read()[0]
+    os.waitpid(pid, 0)
+    assert child_taken == 8
+    assert sum(bucket.take() for _ in range(8)) == 2
+
+
+@override_settings(
+    CONTENT_SECURITY_POLICY={"REPORT_RATE_LIMIT": 0.001, "REPORT_RATE_LIMIT_BURST": 3, "DIRECTIVES": {"report-uri": "x", "report-to": "y"}}
+)
+def test_report_rate_limit() -> None:
+    headers = []
+    for _ in range(10):
+        request = rf.get("/")
+        response = HttpResponse()
+        mw.process_response(request, response)
+        headers.append(response[HEADER])
+    assert headers[:3] == ["default-src 'self'; report-to y; report-uri x"] * 3
+    assert headers[3:] == ["default-src 'self'"] * 7
+
+
+@override_settings(
+    CONTENT_SECURITY_POLICY={"REPORT_PERCENTAGE": 0, "REPORT_RATE_LIMIT": 1, "DIRECTIVES": {"report-uri": "x"}},
+    CONTENT_SECURITY_POLICY_REPORT_ONLY={"REPORT_RATE_LIMIT": 1, "DIRECTIVES": {"report-uri": "x"}},
+)
+def test_report_rate_limit_after_percentage() -> None:
+    bucket = get_report_bucket()
+    assert bucket is not None
+    with mock.patch.object(bucket, "take", wraps=bucket.take) as take:
+        request = rf.get("/")
+        response = HttpResponse()
+        mw.process_response(request, response)
+    # Responses dropped by the percentage don't use up the budget.
+    assert take.call_count == 0
+    assert "report-uri" in response[HEADER_REPORT_ONLY]
+    assert get_report_bucket(report_only=True) is not bucket
+
+
+@override_settings(CONTENT_SECURITY_POLICY={"DIRECTIVES": {"report-uri": "x"}})
+def test_no_report_rate_limit() -> None:
+    assert get_report_bucket() is None
+
+
+@override_settings(CONTENT_SECURITY_POLICY={"REPORT_PERCENTAGE": 50, "DIRECTIVES": {"report-uri": "x", "report-to": "y"}})
+def test_report_percentage_reuses_compiled_policies() -> None:
+    @csp_replace({"img-src": ["foo.com"]})
+    def view(request: HttpRequest) -> HttpResponseBase:
+        return HttpResponse()
+
+    replace = getattr(view(rf.get("/")), "_csp_replace")
+    headers = set()
+    compile_count = None
+    for n in range(200):
+        request = rf.get("/")
+        response = view(request)
+        mw.process_response(request, response)
+        headers.add(response[HEADER])
+        assert getattr(response, "_csp_replace") is replace
+        if n == 100:
+            # Both variants have been compiled by now, and are reused from then on.
+            compile_count = get_compile_count()
+    assert get_compile_count() == compile_count
+    assert headers == {"default-src 'self'; img-src foo.com; report-to y; report-uri x", "default-src 'self'; img-src foo.com"}
+    assert replace == {"img-src": ["foo.com"]}
+
+
+@override_settings(
+    CONTENT_SECURITY_POLICY={"REPORT_PERCENTAGE": 0, "DIRECTIVES": {"report-to": "csp"}},
+    CONTENT_SECURITY_POLICY_REPORT_ONLY={"DIRECTIVES": {"report-to": "csp"}},
+    CONTENT_SECURITY_POLICY_REPORTING_ENDPOINTS={"csp": "/csp/"},
+)
+def test_report_percentage_strips_reporting_endpoints() -> None:
+    request = rf.get("/")
+    response = HttpResponse()
+    mw.process_response(request, response)
+    assert "report-to" not in response[HEADER]
+    # The report-only policy still reports.
+    assert response[HEADER_REPORTING_ENDPOINTS] == 'csp="/csp/"'
+
+    with override_settings(CONTENT_SECURITY_POLICY_REPORT_ONLY={"REPORT_PERCENTAGE": 0, "DIRECTIVES": {"report-to": "csp"}}):
+        response = HttpResponse()
+        mw.process_response(request, response)
+        assert "report-to" not in response[HEADER_REPORT_ONLY]
+        assert HEADER_REPORTING_ENDPOINTS not in response
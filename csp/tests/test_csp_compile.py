@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import json
+from io import StringIO
+from typing import TYPE_CHECKING
+from unittest import mock
+
+from django.core.management import call_command
+from django.test.utils import override_settings
+
+import pytest
+
+from csp.constants import NONCE, SELF
+from csp.middleware import CSPMiddleware
+from csp.tests import urls
+from csp.tests.utils import response
+from csp.utils import build_policy, load_compiled_policies
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+CSP_SETTINGS = {"DIRECTIVES": {"default-src": [SELF, NONCE]}}
+
+
+def compile_to(tmp_path: Path) -> str:
+    path = str(tmp_path / "csp.json")
+    call_command("csp_compile", output=path, urlconf="csp.tests.urls", stdout=StringIO())
+    return path
+
+
+@override_settings(CONTENT_SECURITY_POLICY=CSP_SETTINGS)
+def test_csp_compile_stdout() -> None:
+    out = StringIO()
+    call_command("csp_compile", urlconf="csp.tests.urls", stdout=out)
+    data = json.loads(out.getvalue())
+    views = [(entry["view"], entry["report_only"], entry["header"]) for entry in data["policies"]]
+    assert views == [
+        (None, False, "default-src 'self'"),
+        (None, True, ""),
+        ("csp.tests.urls.update_view", False, "default-src 'self'; img-src example.com"),
+        ("csp.tests.urls.stacked_view", False, "default-src example.com"),
+        ("csp.tests.urls.stacked_view", True, ""),
+    ]
+
+
+@override_settings(CONTENT_SECURITY_POLICY=CSP_SETTINGS)
+def test_load_compiled_policies(tmp_path: Path) -> None:
+    path = compile_to(tmp_path)
+
+    # Overriding the settings again clears the policies compiled by the command.
+    with override_settings(CONTENT_SECURITY_POLICY=CSP_SETTINGS):
+        assert load_compiled_policies(path) is True
+        with mock.patch("csp.utils.compile_policy") as compile_policy:
+            update = getattr(urls.update_view, "_csp_update")
+            assert build_policy(nonce="abc123") == "default-src 'self' 'nonce-abc123'"
+            assert build_policy(update=update, nonce="abc123") == "default-src 'self' 'nonce-abc123'; img-src example.com"
+        compile_policy.assert_not_called()
+
+
+@override_settings(CONTENT_SECURITY_POLICY=CSP_SETTINGS)
+def test_load_compiled_policies_for_other_settings(tmp_path: Path) -> None:
+    path = compile_to(tmp_path)
+
+    with override_settings(CONTENT_SECURITY_POLICY={"DIRECTIVES": {"default-src": ["example.com"]}}):
+        with pytest.warns(UserWarning, match="don't match the settings"):
+            assert load_compiled_policies(path) is False
+        assert build_policy() == "default-src example.com"
+
+
+@override_settings(CONTENT_SECURITY_POLICY=CSP_SETTINGS)
+def test_load_compiled_policies_from_other_release(tmp_path: Path) -> None:
+    path = compile_to(tmp_path)
+
+    with mock.patch("csp.utils.version", return_value="0.0.1"):
+        with pytest.warns(UserWarning, match="don't match the settings"):
+            assert load_compiled_policies(path) is False
+    with mock.patch.dict("csp.utils.DEFAULT_DIRECTIVES", {"default-src": ["example.com"]}):
+        with pytest.warns(UserWarning, match="don't match the settings"):
+            assert load_compiled_policies(path) is False
+    assert load_compiled_policies(path) is True
+
+
+@override_settings(CONTENT_SECURITY_POLICY=CSP_SETTINGS)
+def test_middleware_loads_compiled_policies(tmp_path: Path) -> None:
+    path = compile_to(tmp_path)
+
+    with override_settings(CONTENT_SECURITY_POLICY_COMPILED_PATH=path):
+        with mock.patch("csp.middleware.load_compiled_policies") as load:
+            CSPMiddleware(response())
+    load.assert_called_once_with(path)
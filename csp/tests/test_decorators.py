@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import asyncio
 from typing import TYPE_CHECKING
 
 from django.http import HttpResponse
@@ -7,11 +8,14 @@ from django.test import RequestFactory
 from django.test.utils import override_settings
 
 import pytest
+from asgiref.sync import iscoroutinefunction
 
 from csp.constants import HEADER, HEADER_REPORT_ONLY, NONCE
 from csp.decorators import csp, csp_exempt, csp_replace, csp_update
 from csp.middleware import CSPMiddleware
+from csp.tests import urls
 from csp.tests.utils import response
+from csp.utils import get_compiled_decorator_policy, get_compiled_decorator_policy_cache_info, precompile_policies
 
 if TYPE_CHECKING:
     from django.http import HttpRequest, HttpResponseBase
@@ -263,6 +267,73 @@ def test_csp_string_values() -> None:
     assert policy_list == ["font-src bar.com", "img-src foo.com"]
 
 
+def test_decorator_config_is_frozen() -> None:
+    @csp_update({"img-src": ["bar.com"]})
+    def view(request: HttpRequest) -> HttpResponseBase:
+        return HttpResponse()
+
+    response = view(RequestFactory().get("/"))
+    with pytest.raises(TypeError):
+        getattr(response, "_csp_update")["img-src"] = ["baz.com"]
+
+
+@override_settings(CONTENT_SECURITY_POLICY={"DIRECTIVES": {"img-src": ["foo.com"]}})
+def test_decorator_policy_compiled_once() -> None:
+    request = RequestFactory().get("/")
+
+    @csp_update({"img-src": ["bar.com"]})
+    @csp_replace({"default-src": ["example.com"]})
+    def view(request: HttpRequest) -> HttpResponseBase:
+        return HttpResponse()
+
+    response1 = view(request)
+    response2 = view(request)
+    parts = (getattr(response1, "_csp_update"), getattr(response1, "_csp_replace"))
+    assert parts == (getattr(response2, "_csp_update"), getattr(response2, "_csp_replace"))
+    compiled = get_compiled_decorator_policy(None, *parts)
+    assert get_compiled_decorator_policy(None, *parts) is compiled
+
+    mw.process_response(request, response1)
+    policy_list = sorted(response1[HEADER].split("; "))
+    assert policy_list == ["default-src example.com", "img-src foo.com bar.com"]
+
+    with override_settings(CONTENT_SECURITY_POLICY={"DIRECTIVES": {"img-src": ["baz.com"]}}):
+        assert get_compiled_decorator_policy(None, *parts) is not compiled
+        mw.process_response(request, response2)
+        policy_list = sorted(response2[HEADER].split("; "))
+        assert policy_list == ["default-src example.com", "img-src baz.com bar.com"]
+
+
+def test_async_views() -> None:
+    @csp_exempt(REPORT_ONLY=True)
+    @csp({"default-src": ["example.com"]})
+    @csp_update({"img-src": ["foo.com"]})
+    @csp_replace({"font-src": ["bar.com"]})
+    async def view(request: HttpRequest) -> HttpResponseBase:
+        return HttpResponse()
+
+    assert iscoroutinefunction(view)
+    request = RequestFactory().get("/")
+    response = asyncio.run(view(request))
+    assert getattr(response, "_csp_exempt_ro") is True
+    assert getattr(response, "_csp_config") == {"default-src": ["example.com"]}
+    assert getattr(response, "_csp_update") == {"img-src": ["foo.com"]}
+    assert getattr(response, "_csp_replace") == {"font-src": ["bar.com"]}
+    mw.process_response(request, response)
+    policy_list = sorted(response[HEADER].split("; "))
+    assert policy_list == ["default-src example.com", "font-src bar.com", "img-src foo.com"]
+    assert HEADER_REPORT_ONLY not in response
+
+
+def test_sync_views_stay_sync() -> None:
+    @csp_exempt()
+    @csp_update({"img-src": ["foo.com"]})
+    def view(request: HttpRequest) -> HttpResponseBase:
+        return HttpResponse()
+
+    assert not iscoroutinefunction(view)
+
+
 # Deprecation tests
 
 
@@ -304,3 +375,33 @@ def test_csp_error() -> None:
             return HttpResponse()
 
     assert "Incompatible `csp` decorator arguments" in str(excinfo.value)
+
+
+def test_decorator_configs_set_on_view() -> None:
+    assert getattr(urls.stacked_view, "_csp_config") == {"default-src": ["example.com"]}
+    assert getattr(urls.stacked_view, "_csp_update_ro") == {"img-src": ["example.com"]}
+    assert not hasattr(urls.stacked_view, "_csp_update")
+
+
+@override_settings(CONTENT_SECURITY_POLICY={"DIRECTIVES": {"default-src": ["'self'"]}})
+def test_precompile_policies() -> None:
+    assert precompile_policies("csp.tests.urls") == 2
+    info = get_compiled_decorator_policy_cache_info()
+    assert (info.hits, info.misses) == (0, 3)
+
+    # Requests to the decorated views use the precompiled policies.
+    for view in (urls.update_view, urls.stacked_view):
+        request = RequestFactory().get("/")
+        mw.process_response(request, view(request))
+    info = get_compiled_decorator_policy_cache_info()
+    assert (info.hits, info.misses) == (3, 3)
+
+
+@override_settings(
+    CONTENT_SECURITY_POLICY={"DIRECTIVES": {"default-src": ["'self'"]}},
+    CONTENT_SECURITY_POLICY_PRECOMPILE=True,
+    ROOT_URLCONF="csp.tests.urls",
+)
+def test_middleware_precompiles_policies() -> None:
+    CSPMiddleware(response())
+    assert get_compiled_decorator_policy_cache_info().misses == 3
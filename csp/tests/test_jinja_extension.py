@@ -1,4 +1,7 @@
+from django.test.utils import override_settings
+
 from csp.tests.utils import ScriptExtensionTestBase
+from csp.utils import script_hash_marker, script_hash_source
 
 
 class TestJinjaExtension(ScriptExtensionTestBase):
@@ -85,3 +88,41 @@ class TestJinjaExtension(ScriptExtensionTestBase):
         expected = '<script nonce="{}">let capture_text = "<script></script>"</script>'
 
         self.assert_template_eq(*self.process_templates(tpl, expected))
+
+    @override_settings(CONTENT_SECURITY_POLICY_SCRIPT_HASHES=True)
+    def test_constant_script_uses_hash(self) -> None:
+        tpl = """
+            {% script %}
+                <script>var hello='world';</script>
+            {% endscript %}"""
+
+        output, header = self.process_templates_with_header(tpl)
+        script_hash = script_hash_source("var hello='world';")
+        assert output == script_hash_marker(script_hash) + "<script>var hello='world';</script>"
+        assert header == f"default-src 'self' {script_hash}"
+
+    @override_settings(CONTENT_SECURITY_POLICY_SCRIPT_HASHES=True)
+    def test_dynamic_script_uses_nonce(self) -> None:
+        tpl = """
+            {% script %}var hello='{{ request.path }}';{% endscript %}"""
+
+        output, header = self.process_templates_with_header(tpl)
+        nonce = header.split("'nonce-")[1].rstrip("'")
+        assert output == f"<script nonce=\"{nonce}\">var hello='/';</script>"
+
+    @override_settings(CONTENT_SECURITY_POLICY_SCRIPT_HASHES=True)
+    def test_script_with_src_uses_nonce(self) -> None:
+        tpl = """
+            {% script src="foo.js" %}{% endscript %}"""
+
+        output, header = self.process_templates_with_header(tpl)
+        nonce = header.split("'nonce-")[1].rstrip("'")
+        assert output == f'<script nonce="{nonce}" src="foo.js"></script>'
+
+    def test_constant_script_uses_nonce_by_default(self) -> None:
+        tpl = """
+            {% script %}var hello='world';{% endscript %}"""
+
+        output, header = self.process_templates_with_header(tpl)
+        assert "'sha256-" not in header
+        assert "nonce=" in output
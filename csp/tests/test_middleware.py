@@ -1,18 +1,40 @@
+from __future__ import annotations
+
+import asyncio
+import gzip
+import io
+import re
+from typing import TYPE_CHECKING
+from unittest import mock
+
+from django.core.exceptions import ImproperlyConfigured
 from django.http import (
+    FileResponse,
     HttpResponse,
     HttpResponseNotFound,
     HttpResponseServerError,
+    StreamingHttpResponse,
 )
+from django.middleware.gzip import GZipMiddleware
 from django.template import Context, Template, engines
-from django.test import RequestFactory
+from django.test import AsyncRequestFactory, RequestFactory
 from django.test.utils import override_settings
+from django.views.decorators.cache import cache_page
 
 import pytest
+from asgiref.sync import iscoroutinefunction
 
-from csp.constants import HEADER, HEADER_REPORT_ONLY, SELF
+from csp.constants import HEADER, HEADER_REPORT_ONLY, HEADER_REPORT_TO, HEADER_REPORTING_ENDPOINTS, HTML_CONTENT_TYPES, SELF
 from csp.exceptions import CSPNonceError
-from csp.middleware import CheckableLazyObject, CSPMiddleware
+from csp.middleware import CheckableLazyObject, CSPMiddleware, PolicyParts
+from csp.nonce import get_nonce_placeholder
 from csp.tests.utils import response
+from csp.utils import build_policy, get_reporting_endpoints_headers, script_hash_source
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncIterator
+
+    from django.http import HttpRequest, HttpResponseBase
 
 mw = CSPMiddleware(response())
 rf = RequestFactory()
@@ -32,6 +54,43 @@ def test_checkable_lazy_object() -> None:
     assert bool(lazy) is True
 
 
+def test_async_middleware() -> None:
+    async def get_response(request: HttpRequest) -> HttpResponseBase:
+        return HttpResponse(f"The CSP nonce is {getattr(request, 'csp_nonce')}.")
+
+    async_mw = CSPMiddleware(get_response)
+    assert iscoroutinefunction(async_mw)
+
+    request = AsyncRequestFactory().get("/")
+    # The request and response are processed on the event loop rather than in a thread.
+    with mock.patch("django.utils.deprecation.sync_to_async", side_effect=AssertionError):
+        response = asyncio.run(async_mw(request))
+
+    nonce = getattr(request, "_csp_nonce")
+    assert response.content.decode() == f"The CSP nonce is {nonce}."
+    assert response[HEADER] == f"default-src 'self' 'nonce-{nonce}'"
+
+
+def test_policy_parts() -> None:
+    config = {"default-src": ["example.com"]}
+    policy_parts = PolicyParts(config, nonce="abc123")
+    assert not hasattr(policy_parts, "__dict__")
+    assert policy_parts == PolicyParts(config=config, nonce="abc123")
+    assert policy_parts.to_kwargs() == {"config": config, "update": None, "replace": None, "nonce": "abc123", "hashes": None, "reporting": True}
+    assert policy_parts.to_kwargs()["config"] is config
+
+
+def test_policy_parts_not_copied() -> None:
+    request = rf.get("/")
+    response = HttpResponse()
+    config = {"default-src": ["example.com"]}
+    setattr(response, "_csp_config", config)
+    with mock.patch("csp.middleware.build_policy", wraps=build_policy) as build_policy_mock:
+        mw.process_response(request, response)
+    assert build_policy_mock.call_args_list[0].kwargs["config"] is config
+    assert response[HEADER] == "default-src example.com"
+
+
 def test_add_header() -> None:
     request = rf.get("/")
     response = HttpResponse()
@@ -100,6 +159,159 @@ def test_dont_replace() -> None:
     assert response[HEADER] == "default-src example.com"
 
 
+@override_settings(CONTENT_SECURITY_POLICY={"EXCLUDE_URL_PREFIXES": [re.compile(r"/inlines-r-us\Z")]})
+def test_exclude_pattern() -> None:
+    request = rf.get("/inlines-r-us")
+    response = HttpResponse()
+    mw.process_response(request, response)
+    assert HEADER not in response
+
+    request = rf.get("/inlines-r-us/foo")
+    response = HttpResponse()
+    mw.process_response(request, response)
+    assert HEADER in response
+
+
+@override_settings(
+    CONTENT_SECURITY_POLICY={"EXCLUDE_URL_PREFIXES": ["/inlines-r-us"]},
+    CONTENT_SECURITY_POLICY_REPORT_ONLY={"EXCLUDE_URL_PREFIXES": ["/inlines-r-us"]},
+)
+def test_exclude_skips_building_policy() -> None:
+    request = rf.get("/inlines-r-us/foo")
+    response = HttpResponse()
+    with mock.patch.object(mw, "get_policy_parts") as get_policy_parts, mock.patch("csp.middleware.build_policy") as build_policy_mock:
+        mw.process_response(request, response)
+    get_policy_parts.assert_not_called()
+    build_policy_mock.assert_not_called()
+    assert HEADER not in response
+    assert HEADER_REPORT_ONLY not in response
+
+
+@override_settings(CONTENT_SECURITY_POLICY_REPORT_ONLY={"DIRECTIVES": {"default-src": [SELF]}})
+def test_exempt_and_existing_header_skip_building_policy() -> None:
+    request = rf.get("/")
+    response = HttpResponse()
+    setattr(response, "_csp_exempt", True)
+    response[HEADER_REPORT_ONLY] = "default-src example.com"
+    with mock.patch.object(mw, "get_policy_parts") as get_policy_parts:
+        mw.process_response(request, response)
+    get_policy_parts.assert_not_called()
+    assert HEADER not in response
+    assert response[HEADER_REPORT_ONLY] == "default-src example.com"
+
+
+@override_settings(
+    CONTENT_SECURITY_POLICY={"CONTENT_TYPES": HTML_CONTENT_TYPES},
+    CONTENT_SECURITY_POLICY_REPORT_ONLY={"CONTENT_TYPES": ["Application/XHTML+XML"]},
+)
+def test_content_types() -> None:
+    request = rf.get("/")
+    response = HttpResponse(content_type="application/json")
+    with mock.patch.object(mw, "get_policy_parts") as get_policy_parts:
+        mw.process_response(request, response)
+    get_policy_parts.assert_not_called()
+    assert HEADER not in response
+    assert HEADER_REPORT_ONLY not in response
+
+    response = HttpResponse(content_type="text/html; charset=utf-8")
+    mw.process_response(request, response)
+    assert HEADER in response
+    assert HEADER_REPORT_ONLY not in response
+
+    response = HttpResponse(content_type="application/xhtml+xml")
+    mw.process_response(request, response)
+    assert HEADER in response
+    assert HEADER_REPORT_ONLY in response
+
+
+@override_settings(
+    CONTENT_SECURITY_POLICY_REPORT_ONLY={"SAMPLE_PERCENTAGE": 25, "SAMPLE_KEY": "META.REMOTE_ADDR", "DIRECTIVES": {"default-src": [SELF]}}
+)
+def test_report_only_sampling() -> None:
+    def sampled(ip: str) -> bool:
+        request = rf.get("/", REMOTE_ADDR=ip)
+        response = HttpResponse()
+        mw.process_response(request, response)
+        assert HEADER in response
+        return HEADER_REPORT_ONLY in response
+
+    ips = [f"10.0.{n // 256}.{n % 256}" for n in range(2000)]
+    selected = [ip for ip in ips if sampled(ip)]
+    # Roughly 25%
+    assert 400 <= len(selected) <= 600
+    # The same clients are sampled every time.
+    assert all(sampled(ip) for ip in selected[:50])
+    # And still are with a higher percentage.
+    with override_settings(CONTENT_SECURITY_POLICY_REPORT_ONLY={"SAMPLE_PERCENTAGE": 50, "SAMPLE_KEY": "META.REMOTE_ADDR"}):
+        assert all(sampled(ip) for ip in selected)
+
+    # Unsampled requests don't build the policy.
+    unsampled = next(ip for ip in ips if ip not in selected)
+    with mock.patch.object(mw, "get_policy_parts", wraps=mw.get_policy_parts) as get_policy_parts:
+        assert not sampled(unsampled)
+    assert get_policy_parts.call_count == 1
+
+
+def test_report_only_sampling_key() -> None:
+    policy = {"SAMPLE_PERCENTAGE": 100, "SAMPLE_KEY": lambda request: request.GET.get("user"), "DIRECTIVES": {"default-src": [SELF]}}
+    with override_settings(CONTENT_SECURITY_POLICY_REPORT_ONLY=policy):
+        response = mw.process_response(rf.get("/?user=1"), HttpResponse())
+        assert HEADER_REPORT_ONLY in response
+        # Requests without a key are never sampled.
+        response = mw.process_response(rf.get("/"), HttpResponse())
+        assert HEADER_REPORT_ONLY not in response
+
+    with override_settings(CONTENT_SECURITY_POLICY_REPORT_ONLY={"SAMPLE_PERCENTAGE": 100}):
+        with pytest.raises(ImproperlyConfigured):
+            mw.process_response(rf.get("/"), HttpResponse())
+
+
+@override_settings(
+    CONTENT_SECURITY_POLICY={"DIRECTIVES": {"default-src": [SELF], "report-to": "csp"}},
+    CONTENT_SECURITY_POLICY_REPORTING_ENDPOINTS={"csp": "https://example.com/csp/", "other": '/a"b\\c'},
+)
+def test_reporting_endpoints() -> None:
+    response = mw.process_response(rf.get("/"), HttpResponse())
+    assert response[HEADER] == "default-src 'self'; report-to csp"
+    assert response[HEADER_REPORTING_ENDPOINTS] == 'csp="https://example.com/csp/", other="/a\\"b\\\\c"'
+    assert HEADER_REPORT_TO not in response
+    # The headers are serialized once.
+    assert get_reporting_endpoints_headers() is get_reporting_endpoints_headers()
+
+    # An existing header is kept.
+    existing = HttpResponse()
+    existing[HEADER_REPORTING_ENDPOINTS] = 'csp="/view/"'
+    assert mw.process_response(rf.get("/"), existing)[HEADER_REPORTING_ENDPOINTS] == 'csp="/view/"'
+
+    # Responses without a policy don't get the endpoints.
+    exempt = HttpResponse()
+    setattr(exempt, "_csp_exempt", True)
+    assert HEADER_REPORTING_ENDPOINTS not in mw.process_response(rf.get("/"), exempt)
+
+
+@override_settings(
+    CONTENT_SECURITY_POLICY_REPORTING_ENDPOINTS={"csp": "https://example.com/csp/"},
+    CONTENT_SECURITY_POLICY_REPORT_TO_MAX_AGE=86400,
+)
+def test_reporting_endpoints_report_to() -> None:
+    response = mw.process_response(rf.get("/"), HttpResponse())
+    assert response[HEADER_REPORTING_ENDPOINTS] == 'csp="https://example.com/csp/"'
+    assert response[HEADER_REPORT_TO] == '{"group":"csp","max_age":86400,"endpoints":[{"url":"https://example.com/csp/"}]}'
+
+
+def test_no_reporting_endpoints() -> None:
+    assert get_reporting_endpoints_headers() == ()
+    response = mw.process_response(rf.get("/"), HttpResponse())
+    assert HEADER_REPORTING_ENDPOINTS not in response
+
+
+def test_content_types_default_to_all() -> None:
+    request = rf.get("/")
+    response = HttpResponse(content_type="application/json")
+    mw.process_response(request, response)
+    assert HEADER in response
+
+
 def test_use_config() -> None:
     request = rf.get("/")
     response = HttpResponse()
@@ -287,3 +499,203 @@ def test_set_nonce_access_after_middleware_is_ok() -> None:
     mw.process_response(request, HttpResponse())
     assert bool(getattr(request, "csp_nonce", False)) is True
     assert str(getattr(request, "csp_nonce")) == nonce
+
+
+@override_settings(CONTENT_SECURITY_POLICY_NONCE_PLACEHOLDER=True)
+def test_nonce_placeholder_substituted() -> None:
+    placeholder = get_nonce_placeholder()
+    assert placeholder is not None
+    request = rf.get("/")
+    mw.process_request(request)
+    assert getattr(request, "csp_nonce") == placeholder
+
+    template = Template("{% load csp %}{% script %}var hello='world';{% endscript %}")
+    response = HttpResponse(template.render(Context({"request": request})), headers={"Content-Length": "0"})
+    assert placeholder.encode() in response.content
+    mw.process_response(request, response)
+
+    nonce = getattr(request, "_csp_nonce")
+    assert response.content == f"<script nonce=\"{nonce}\">var hello='world';</script>".encode()
+    assert response[HEADER] == f"default-src 'self' 'nonce-{nonce}'"
+    assert response["Content-Length"] == str(len(response.content))
+
+
+@override_settings(CONTENT_SECURITY_POLICY_NONCE_PLACEHOLDER=True)
+def test_nonce_placeholder_not_in_body() -> None:
+    request = rf.get("/")
+    mw.process_request(request)
+    response = HttpResponse("No nonce here.")
+    mw.process_response(request, response)
+    assert response.content == b"No nonce here."
+    assert response[HEADER] == "default-src 'self'"
+
+
+@override_settings(CONTENT_SECURITY_POLICY_NONCE_PLACEHOLDER=True)
+def test_nonce_placeholder_substituted_without_header() -> None:
+    request = rf.get("/")
+    mw.process_request(request)
+    response = HttpResponse(f"The CSP nonce is {getattr(request, 'csp_nonce')}.")
+    response._csp_exempt = True  # type: ignore[attr-defined]
+    mw.process_response(request, response)
+    assert HEADER not in response
+    assert response.content == f"The CSP nonce is {getattr(request, '_csp_nonce')}.".encode()
+
+
+@override_settings(CONTENT_SECURITY_POLICY_NONCE_PLACEHOLDER=True)
+def test_nonce_placeholder_with_cached_page() -> None:
+    calls = []
+
+    @cache_page(60, key_prefix="test_nonce_placeholder_with_cached_page")
+    def view(request: HttpRequest) -> HttpResponse:
+        calls.append(request)
+        return HttpResponse(f"The CSP nonce is {getattr(request, 'csp_nonce')}.")
+
+    cached_mw = CSPMiddleware(view)
+    responses = []
+    for _ in range(2):
+        resp = cached_mw(rf.get("/cached/"))
+        assert isinstance(resp, HttpResponse)
+        responses.append(resp)
+
+    assert len(calls) == 1
+    nonces = [resp[HEADER].split("'nonce-")[1].rstrip("'") for resp in responses]
+    assert nonces[0] != nonces[1]
+    for resp, nonce in zip(responses, nonces):
+        assert resp.content == f"The CSP nonce is {nonce}.".encode()
+
+
+@override_settings(CONTENT_SECURITY_POLICY_NONCE_PLACEHOLDER=True)
+def test_nonce_placeholder_with_gzip() -> None:
+    def view(request: HttpRequest) -> HttpResponse:
+        return HttpResponse(f"The CSP nonce is {getattr(request, 'csp_nonce')}. " * 10)
+
+    # The compressed body can't be checked, so it's never sent.
+    with pytest.raises(ImproperlyConfigured, match="Content-Encoding: gzip"):
+        CSPMiddleware(GZipMiddleware(view))(rf.get("/", HTTP_ACCEPT_ENCODING="gzip"))
+
+    # Compressing after the placeholder is replaced works.
+    resp = GZipMiddleware(CSPMiddleware(view))(rf.get("/", HTTP_ACCEPT_ENCODING="gzip"))
+    assert isinstance(resp, HttpResponse)
+    nonce = resp[HEADER].split("'nonce-")[1].rstrip("'")
+    assert gzip.decompress(resp.content) == f"The CSP nonce is {nonce}. ".encode() * 10
+
+
+@override_settings(CONTENT_SECURITY_POLICY_NONCE_PLACEHOLDER=True)
+def test_nonce_placeholder_in_streaming_response() -> None:
+    request = rf.get("/")
+    mw.process_request(request)
+    placeholder = getattr(request, "csp_nonce")
+    # Split so the placeholder spans chunks.
+    body = f"<script nonce='{placeholder}'></script>" * 2
+    response = StreamingHttpResponse([body[:20], body[20:], ""])
+    mw.process_response(request, response)
+    nonce = getattr(request, "_csp_nonce")
+    assert response[HEADER] == f"default-src 'self' 'nonce-{nonce}'"
+    assert b"".join(response) == f"<script nonce='{nonce}'></script>".encode() * 2
+
+
+@override_settings(CONTENT_SECURITY_POLICY_NONCE_PLACEHOLDER=True)
+def test_nonce_placeholder_in_async_streaming_response() -> None:
+    request = rf.get("/")
+    mw.process_request(request)
+    placeholder = getattr(request, "csp_nonce")
+
+    async def content() -> AsyncIterator[str]:
+        yield f"<script nonce='{placeholder[:5]}"
+        yield f"{placeholder[5:]}'></script>"
+
+    async def read(response: StreamingHttpResponse) -> bytes:
+        return b"".join([chunk async for chunk in response])
+
+    response = StreamingHttpResponse(content())
+    mw.process_response(request, response)
+    assert asyncio.run(read(response)) == f"<script nonce='{getattr(request, '_csp_nonce')}'></script>".encode()
+
+
+@override_settings(CONTENT_SECURITY_POLICY_NONCE_PLACEHOLDER=True)
+def test_nonce_placeholder_blanked_in_file_response() -> None:
+    request = rf.get("/")
+    mw.process_request(request)
+    placeholder = getattr(request, "csp_nonce")
+    response = FileResponse(io.BytesIO(f"nonce={placeholder}".encode()))
+    mw.process_response(request, response)
+    assert b"".join(response) == b"nonce=" + b"-" * len(placeholder)
+    assert response["Content-Length"] == str(len(placeholder) + 6)
+
+
+@override_settings(CONTENT_SECURITY_POLICY_NONCE_PLACEHOLDER=True)
+def test_nonce_placeholder_in_header() -> None:
+    request = rf.get("/")
+    mw.process_request(request)
+    response = HttpResponse(headers={"Link": f"</app.js>; rel=preload; as=script; nonce={getattr(request, 'csp_nonce')}"})
+    mw.process_response(request, response)
+    assert response["Link"] == f"</app.js>; rel=preload; as=script; nonce={getattr(request, '_csp_nonce')}"
+
+
+@override_settings(CONTENT_SECURITY_POLICY_SCRIPT_HASHES=True)
+def test_script_hashes_with_cached_page() -> None:
+    calls = []
+    tpl = Template("{% load csp %}{% script %}var hello='world';{% endscript %}")
+
+    @cache_page(60, key_prefix="test_script_hashes_with_cached_page")
+    def view(request: HttpRequest) -> HttpResponse:
+        calls.append(request)
+        return HttpResponse(tpl.render(Context({"request": request})))
+
+    cached_mw = CSPMiddleware(view)
+    responses = []
+    for _ in range(2):
+        resp = cached_mw(rf.get("/cached/"))
+        assert isinstance(resp, HttpResponse)
+        responses.append(resp)
+
+    assert len(calls) == 1
+    script_hash = script_hash_source("var hello='world';")
+    for resp in responses:
+        assert resp[HEADER] == f"default-src 'self' {script_hash}"
+
+
+@override_settings(CONTENT_SECURITY_POLICY_SCRIPT_HASHES=True)
+def test_script_hashes_with_cached_fragment() -> None:
+    tpl = Template(
+        "{% load cache csp %}{% script %}var live=1;{% endscript %}"
+        "{% cache 60 test_script_hashes_with_cached_fragment %}{% script %}var cached=1;{% endscript %}{% endcache %}"
+    )
+    hashes = f"{script_hash_source('var live=1;')} {script_hash_source('var cached=1;')}"
+    # The second time, the fragment is replayed from the cache without its script being rendered.
+    for _ in range(2):
+        request = rf.get("/")
+        mw.process_request(request)
+        resp = mw.process_response(request, HttpResponse(tpl.render(Context({"request": request}))))
+        assert resp[HEADER] == f"default-src 'self' {hashes}"
+
+
+@override_settings(CONTENT_SECURITY_POLICY_NONCE_PLACEHOLDER=True)
+def test_nonce_placeholder_depends_on_secret_key() -> None:
+    placeholder = get_nonce_placeholder()
+    with override_settings(SECRET_KEY="another-secret-key"):
+        assert get_nonce_placeholder() != placeholder
+    assert get_nonce_placeholder() == placeholder
+
+
+def test_no_server_timing_by_default() -> None:
+    request = rf.get("/")
+    mw.process_request(request)
+    response = mw.process_response(request, HttpResponse())
+    assert "Server-Timing" not in response
+
+
+@override_settings(CONTENT_SECURITY_POLICY_SERVER_TIMING=True)
+def test_server_timing() -> None:
+    request = rf.get("/")
+    mw.process_request(request)
+    response = mw.process_response(request, HttpResponse())
+    assert re.fullmatch(r"csp;dur=\d+\.\d{3}", response["Server-Timing"])
+
+
+@override_settings(CONTENT_SECURITY_POLICY_SERVER_TIMING=True)
+def test_server_timing_merged() -> None:
+    request = rf.get("/")
+    mw.process_request(request)
+    response = mw.process_response(request, HttpResponse(headers={"Server-Timing": "db;dur=53"}))
+    assert re.fullmatch(r"db;dur=53, csp;dur=\d+\.\d{3}", response["Server-Timing"])
@@ -0,0 +1,157 @@
+import base64
+import gc
+import os
+import threading
+import tracemalloc
+from unittest import mock
+
+from django.test import RequestFactory
+from django.test.utils import override_settings
+
+import pytest
+
+from csp.exceptions import CSPNonceError
+from csp.middleware import CSPMiddleware
+from csp.nonce import NONCE_BYTES, POST_RESPONSE_NONCE, LazyNonce, NoncePool, get_nonce_source, pooled_nonce, random_nonce
+from csp.tests.utils import response
+
+rf = RequestFactory()
+
+
+def test_random_nonce() -> None:
+    nonce = random_nonce()
+    assert len(base64.b64decode(nonce)) == NONCE_BYTES
+    assert nonce != random_nonce()
+
+
+def test_nonce_pool_reads_entropy_once_per_block() -> None:
+    pool = NoncePool(size=4)
+    with mock.patch("csp.nonce.os.urandom", wraps=os.urandom) as urandom:
+        nonces = [pool() for _ in range(8)]
+    assert urandom.call_count == 2
+    assert urandom.call_args.args == (NONCE_BYTES * 4,)
+    assert len(set(nonces)) == 8
+    assert all(len(base64.b64decode(nonce)) == NONCE_BYTES for nonce in nonces)
+
+
+def test_nonce_pool_per_thread() -> None:
+    pool = NoncePool(size=4)
+    nonces = [pool()]
+
+    thread = threading.Thread(target=lambda: nonces.append(pool()))
+    thread.start()
+    thread.join()
+
+    assert len(set(nonces)) == 2
+
+
+def test_nonce_pool_discards_buffer_after_fork() -> None:
+    pool = NoncePool(size=4)
+    pool()
+    with mock.patch("csp.nonce.os.urandom", wraps=os.urandom) as urandom:
+        pool()
+        assert urandom.call_count == 0
+        # Simulates the `os.register_at_fork` callback running in a child process.
+        pool._after_fork()
+        pool()
+        assert urandom.call_count == 1
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires os.fork")
+def test_nonce_pool_fork() -> None:
+    pool = NoncePool(size=4)
+    pool()
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:  # pragma: no cover
+        os.close(read_fd)
+        os.write(write_fd, pool().encode("ascii"))
+        os._exit(0)
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        child_nonce = f.read()
+    os.waitpid(pid, 0)
+    assert child_nonce != pool()
+
+
+def test_default_nonce_source() -> None:
+    assert get_nonce_source() is random_nonce
+
+
+@override_settings(CONTENT_SECURITY_POLICY_NONCE_SOURCE="csp.nonce.pooled_nonce")
+def test_nonce_source_dotted_path() -> None:
+    assert get_nonce_source() is pooled_nonce
+
+
+def test_nonce_source_callable() -> None:
+    with override_settings(CONTENT_SECURITY_POLICY_NONCE_SOURCE=lambda: "abc123"):
+        mw = CSPMiddleware(response())
+        request = rf.get("/")
+        mw.process_request(request)
+        assert str(getattr(request, "csp_nonce")) == "abc123"
+    assert get_nonce_source() is random_nonce
+
+
+def test_lazy_nonce() -> None:
+    mw = CSPMiddleware(response())
+    request = rf.get("/")
+    nonce = LazyNonce(mw, request)
+    assert bool(nonce) is False
+    assert not hasattr(request, "_csp_nonce")
+    assert repr(nonce) == "<LazyNonce: not generated>"
+
+    value = str(nonce)
+    assert bool(nonce) is True
+    assert getattr(request, "_csp_nonce") == value
+    assert nonce == value
+    assert f"{nonce}" == value
+    assert "nonce-" + nonce == f"nonce-{value}"
+    assert len(nonce) == len(value)
+    assert nonce.encode() == value.encode()
+    assert hash(nonce) == hash(value)
+    assert repr(nonce) == f"<LazyNonce: {value!r}>"
+    assert nonce[:8] == value[:8]
+    assert nonce[0] == value[0]
+    assert not nonce < value and nonce <= value and not nonce > value and nonce >= value
+
+
+def test_lazy_nonce_protocol_lookups_do_not_generate() -> None:
+    nonce = LazyNonce(CSPMiddleware(response()), rf.get("/"))
+    assert not hasattr(nonce, "__html__")
+    assert bool(nonce) is False
+
+
+def test_post_response_nonce_is_shared() -> None:
+    mw = CSPMiddleware(response())
+    requests = [rf.get("/") for _ in range(2)]
+    for request in requests:
+        mw.process_request(request)
+        mw.process_response(request, response()(request))
+        assert getattr(request, "csp_nonce") is POST_RESPONSE_NONCE
+    assert bool(POST_RESPONSE_NONCE) is False
+    with pytest.raises(CSPNonceError):
+        str(POST_RESPONSE_NONCE)
+
+
+def test_process_request_allocations() -> None:
+    mw = CSPMiddleware(response())
+    requests = [rf.get("/") for _ in range(100)]
+    # Fill the caches of settings read per request first, and let signals prune receivers left by
+    # other tests.
+    gc.collect()
+    mw.process_request(rf.get("/"))
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        for request in requests:
+            mw.process_request(request)
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    stats = after.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)]).compare_to(
+        before.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)]), "filename"
+    )
+    # A single `LazyNonce` per request.
+    assert sum(stat.count_diff for stat in stats) <= len(requests)
@@ -0,0 +1,276 @@
+from __future__ import annotations
+
+import json
+import os
+import subprocess
+import sys
+import threading
+from typing import Any
+from unittest import mock
+
+from django.test import Client, RequestFactory
+from django.test.utils import override_settings
+from django.urls import path
+
+import pytest
+
+from csp.reports import ReportAggregator, ReportQueue, get_report_queue, parse_reports
+from csp.views import report
+
+rf = RequestFactory()
+
+urlpatterns = [path("csp-report/", report)]
+
+CSP_REPORT = {
+    "csp-report": {
+        "document-uri": "https://example.com/",
+        "blocked-uri": "https://evil.example.com/x.js",
+        "violated-directive": "script-src",
+    }
+}
+REPORTING_API_REPORTS = [
+    {
+        "type": "csp-violation",
+        "url": "https://example.com/",
+        "body": {
+            "documentURL": "https://example.com/",
+            "blockedURL": "https://evil.example.com/x.js",
+            "effectiveDirective": "script-src-elem",
+            "disposition": "enforce",
+        },
+    },
+    {"type": "deprecation", "url": "https://example.com/", "body": {"id": "x"}},
+]
+
+received: list[list[dict[str, Any]]] = []
+
+
+def collect(reports: list[dict[str, Any]]) -> None:
+    received.append(reports)
+
+
+def post(body: Any, content_type: str = "application/csp-report", **extra: Any) -> Any:
+    data = body if isinstance(body, (str, bytes)) else json.dumps(body)
+    return report(rf.post("/csp-report/", data=data, content_type=content_type, **extra))
+
+
+@pytest.fixture(autouse=True)
+def sink() -> Any:
+    received.clear()
+    with override_settings(CONTENT_SECURITY_POLICY_REPORTS={"SINK": "csp.tests.test_reports.collect", "MAX_BODY_SIZE": 1024}):
+        yield
+    received.clear()
+
+
+def test_parse_csp_report() -> None:
+    assert parse_reports(CSP_REPORT) == [CSP_REPORT["csp-report"]]
+
+
+def test_parse_reporting_api() -> None:
+    assert parse_reports(REPORTING_API_REPORTS) == [
+        {
+            "document-uri": "https://example.com/",
+            "blocked-uri": "https://evil.example.com/x.js",
+            "effective-directive": "script-src-elem",
+            "violated-directive": "script-src-elem",
+            "disposition": "enforce",
+        }
+    ]
+
+
+@pytest.mark.parametrize("data", [{}, {"csp-report": "x"}, [1], [{"type": "csp-violation"}], "report", None])
+def test_parse_invalid(data: Any) -> None:
+    with pytest.raises(ValueError):
+        parse_reports(data)
+
+
+def test_report_view() -> None:
+    assert post(CSP_REPORT).status_code == 204
+    assert post(REPORTING_API_REPORTS, content_type="application/reports+json").status_code == 204
+    get_report_queue().flush()
+    reports = [r for batch in received for r in batch]
+    assert [r["violated-directive"] for r in reports] == ["script-src", "script-src-elem"]
+
+
+@override_settings(ROOT_URLCONF=__name__)
+def test_report_view_rejects() -> None:
+    assert Client().get("/csp-report/").status_code == 405
+    assert post(CSP_REPORT, content_type="text/plain").status_code == 415
+    assert post("{not json").status_code == 400
+    with override_settings(CONTENT_SECURITY_POLICY_REPORTS={"MAX_BODY_SIZE": 64 * 1024}):
+        assert post("[" * 30000 + "]" * 30000).status_code == 400
+    assert post({"csp-report": {"x": "y" * 1024}}).status_code == 413
+    get_report_queue().flush()
+    assert received == []
+
+
+@override_settings(ROOT_URLCONF=__name__)
+def test_report_view_is_csrf_exempt() -> None:
+    client = Client(enforce_csrf_checks=True)
+    resp = client.post("/csp-report/", data=json.dumps(CSP_REPORT), content_type="application/csp-report")
+    assert resp.status_code == 204
+
+
+def test_queue_drops_overflow() -> None:
+    # Block the sink so the queue fills up behind the first batch.
+    release = threading.Event()
+    started = threading.Event()
+    batches: list[list[dict[str, Any]]] = []
+
+    def blocking_sink(reports: list[dict[str, Any]]) -> None:
+        started.set()
+        release.wait(5)
+        batches.append(reports)
+
+    report_queue = ReportQueue(blocking_sink, maxsize=2, batch_size=1)
+    assert report_queue.put({"n": 0})
+    assert started.wait(5)
+    assert report_queue.put({"n": 1})
+    assert report_queue.put({"n": 2})
+    assert not report_queue.put({"n": 3})
+    assert report_queue.dropped == 1
+
+    release.set()
+    report_queue.close()
+    assert sorted(r["n"] for batch in batches for r in batch) == [0, 1, 2]
+
+
+def test_queue_batches_in_background() -> None:
+    done = threading.Event()
+    batches: list[list[dict[str, Any]]] = []
+
+    def sink(reports: list[dict[str, Any]]) -> None:
+        batches.append(reports)
+        if sum(map(len, batches)) == 5:
+            done.set()
+
+    report_queue = ReportQueue(sink, batch_size=2, flush_interval=0.01)
+    for n in range(5):
+        report_queue.put({"n": n})
+    assert done.wait(5)
+    report_queue.close()
+    assert all(len(batch) <= 2 for batch in batches)
+    assert [r["n"] for batch in batches for r in batch] == list(range(5))
+
+
+def test_queue_counts_sink_failures() -> None:
+    def failing_sink(reports: list[dict[str, Any]]) -> None:
+        raise RuntimeError
+
+    report_queue = ReportQueue(failing_sink)
+    report_queue._queue.put_nowait({"n": 0})
+    report_queue.flush()
+    assert report_queue.failed == 1
+
+
+def test_queue_restarts_after_fork() -> None:
+    report_queue = ReportQueue(collect)
+    report_queue._queue.put_nowait({"n": 0})
+    # Simulates the queue being used for the first time in a forked child process.
+    report_queue._pid = -1
+    report_queue.put({"n": 1})
+    report_queue.close()
+    assert received == [[{"n": 1}]]
+
+
+def test_queue_closed_at_exit() -> None:
+    # The sink prints the reports, and the process exits without closing the queue.
+    code = (
+        "import django; django.setup(); from csp.reports import get_report_queue; "
+        "from django.conf import settings; settings.CONTENT_SECURITY_POLICY_REPORTS = {'SINK': print, 'FLUSH_INTERVAL': 60}; "
+        "get_report_queue().put({'n': 1})"
+    )
+    env = {**os.environ, "DJANGO_SETTINGS_MODULE": "csp.tests.settings"}
+    result = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True)
+    assert result.stdout == "[{'n': 1}]\n"
+
+
+def test_settings_change_replaces_queue() -> None:
+    report_queue = get_report_queue()
+    with override_settings(CONTENT_SECURITY_POLICY_REPORTS={"QUEUE_SIZE": 5}):
+        assert get_report_queue() is not report_queue
+        assert get_report_queue()._queue.maxsize == 5
+
+
+def violation(blocked: str = "https://evil.example.com/x.js", directive: str = "script-src") -> dict[str, Any]:
+    return {"document-uri": "https://example.com/", "blocked-uri": blocked, "violated-directive": directive}
+
+
+def test_aggregator_collapses_duplicates() -> None:
+    aggregator = ReportAggregator(collect, window=60)
+    with mock.patch("csp.reports.time.time", return_value=1000.0):
+        aggregator([violation(), violation(directive="img-src"), violation()])
+    with mock.patch("csp.reports.time.time", return_value=1030.0):
+        aggregator([violation()])
+        aggregator.flush()
+    assert received == []
+
+    with mock.patch("csp.reports.time.time", return_value=1060.0):
+        aggregator.flush()
+    (batch,) = received
+    assert batch == [
+        {
+            "key": {"blocked-uri": "https://evil.example.com/x.js", "violated-directive": "script-src", "document-uri": "https://example.com/"},
+            "count": 3,
+            "first-seen": 1000.0,
+            "last-seen": 1030.0,
+            "sample": violation(),
+        },
+        {
+            "key": {"blocked-uri": "https://evil.example.com/x.js", "violated-directive": "img-src", "document-uri": "https://example.com/"},
+            "count": 1,
+            "first-seen": 1000.0,
+            "last-seen": 1000.0,
+            "sample": violation(directive="img-src"),
+        },
+    ]
+
+
+def test_aggregator_evicts_least_recently_seen() -> None:
+    aggregator = ReportAggregator(collect, max_keys=2)
+    aggregator([violation("a"), violation("b"), violation("a"), violation("c")])
+    assert [(r["key"]["blocked-uri"], r["count"]) for batch in received for r in batch] == [("b", 1)]
+
+    received.clear()
+    aggregator.flush(force=True)
+    assert [(r["key"]["blocked-uri"], r["count"]) for batch in received for r in batch] == [("a", 2), ("c", 1)]
+
+
+def test_aggregator_memory_is_bounded() -> None:
+    aggregator = ReportAggregator(lambda reports: None, max_keys=10)
+    for n in range(1000):
+        aggregator([violation(str(n))])
+    assert len(aggregator._aggregates) == 10
+    assert len(aggregator._by_first_seen) <= 21
+
+
+@pytest.mark.parametrize("aggregate", [None, {"WINDOW": 0}])
+def test_queue_with_aggregator(aggregate: dict[str, Any] | None) -> None:
+    config = {"SINK": "csp.tests.test_reports.collect", "AGGREGATE": aggregate}
+    with override_settings(CONTENT_SECURITY_POLICY_REPORTS=config):
+        report_queue = get_report_queue()
+        assert isinstance(report_queue.sink, ReportAggregator) is (aggregate is not None)
+        for _ in range(3):
+            report_queue.put(violation())
+        report_queue.close()
+    reports = [r for batch in received for r in batch]
+    if aggregate is None:
+        assert reports == [violation()] * 3
+    else:
+        assert sum(r["count"] for r in reports) == 3
+
+
+def test_queue_flushes_idle_sink() -> None:
+    flushed = threading.Event()
+
+    class Sink:
+        def __call__(self, reports: list[dict[str, Any]]) -> None:
+            pass
+
+        def flush(self, force: bool = False) -> None:
+            flushed.set()
+
+    report_queue = ReportQueue(Sink(), flush_interval=0.01)
+    report_queue.put(violation())
+    assert flushed.wait(5)
+    report_queue.close()
@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+from collections.abc import Iterator
+from typing import TYPE_CHECKING, Any
+
+from django.http import HttpResponse, HttpResponseBase, HttpResponseServerError
+from django.test import AsyncRequestFactory, RequestFactory
+from django.test.utils import override_settings
+
+import pytest
+from asgiref.sync import iscoroutinefunction
+
+from csp.constants import HEADER
+from csp.middleware import CSPMiddleware, PolicyParts
+from csp.signals import Metrics, response_processed
+from csp.tests.utils import response
+from csp.utils import compile_policy
+
+if TYPE_CHECKING:
+    from django.http import HttpRequest
+
+mw = CSPMiddleware(response())
+rf = RequestFactory()
+
+
+@pytest.fixture
+def received() -> Iterator[list[dict[str, Any]]]:
+    received: list[dict[str, Any]] = []
+
+    def receiver(**kwargs: Any) -> None:
+        received.append(kwargs)
+
+    response_processed.connect(receiver)
+    try:
+        yield received
+    finally:
+        response_processed.disconnect(receiver)
+
+
+def process(path: str = "/", resp: HttpResponse | None = None, use_nonce: bool = False) -> HttpResponse:
+    request = rf.get(path)
+    mw.process_request(request)
+    if use_nonce:
+        str(getattr(request, "csp_nonce"))
+    result = mw.process_response(request, resp if resp is not None else HttpResponse())
+    assert isinstance(result, HttpResponse)
+    return result
+
+
+def test_no_metrics_without_receivers() -> None:
+    request = rf.get("/")
+    mw.process_request(request)
+    assert not hasattr(request, "_csp_metrics")
+
+
+def test_metrics(received: list[dict[str, Any]]) -> None:
+    resp = process(use_nonce=True)
+    assert HEADER in resp
+
+    assert len(received) == 1
+    assert received[0]["sender"] is CSPMiddleware
+    assert received[0]["response"] is resp
+    metrics = received[0]["metrics"]
+    assert isinstance(metrics, Metrics)
+    assert metrics.nonce_time > 0
+    assert metrics.build_time > 0
+    assert metrics.header_time > 0
+    # The report-only policy isn't configured, but is still built.
+    assert metrics.cache_hits + metrics.cache_misses == 2
+    assert metrics.skipped == []
+
+
+@override_settings(CONTENT_SECURITY_POLICY={"DIRECTIVES": {"default-src": ["'self'"]}})
+def test_metrics_cache_hits(received: list[dict[str, Any]]) -> None:
+    process()
+    process()
+    assert (received[0]["metrics"].cache_hits, received[0]["metrics"].cache_misses) == (0, 2)
+    assert (received[1]["metrics"].cache_hits, received[1]["metrics"].cache_misses) == (2, 0)
+
+
+@override_settings(CONTENT_SECURITY_POLICY={"DIRECTIVES": {"default-src": ["'self'"]}})
+def test_metrics_cache_hits_ignore_other_threads(received: list[dict[str, Any]]) -> None:
+    class OtherThreadCompilingMiddleware(CSPMiddleware):
+        def get_policy_parts(self, *args: Any, **kwargs: Any) -> PolicyParts:
+            thread = threading.Thread(target=compile_policy)
+            thread.start()
+            thread.join()
+            return super().get_policy_parts(*args, **kwargs)
+
+    process()
+    request = rf.get("/")
+    other_mw = OtherThreadCompilingMiddleware(response())
+    other_mw.process_request(request)
+    other_mw.process_response(request, HttpResponse())
+    assert (received[1]["metrics"].cache_hits, received[1]["metrics"].cache_misses) == (2, 0)
+
+
+@override_settings(
+    CONTENT_SECURITY_POLICY={"EXCLUDE_URL_PREFIXES": ["/admin"], "DIRECTIVES": {"default-src": ["'self'"]}},
+    CONTENT_SECURITY_POLICY_REPORT_ONLY={"CONTENT_TYPES": ["text/html"], "DIRECTIVES": {"default-src": ["'self'"]}},
+)
+def test_metrics_skipped(received: list[dict[str, Any]]) -> None:
+    process("/admin/")
+    exempt = HttpResponse(content_type="application/json")
+    exempt._csp_exempt = True  # type: ignore[attr-defined]
+    process(resp=exempt)
+    process(resp=HttpResponse(headers={HEADER: "default-src 'none'"}))
+
+    assert [r["metrics"].skipped for r in received] == [
+        [("excluded_url", False)],
+        [("exempt", False), ("content_type", True)],
+        [("header_exists", False)],
+    ]
+
+
+@override_settings(DEBUG=True)
+def test_metrics_skipped_debug(received: list[dict[str, Any]]) -> None:
+    process(resp=HttpResponseServerError())
+    assert received[0]["metrics"].skipped == [("debug", False), ("debug", True)]
+
+
+def test_async_receiver() -> None:
+    async def get_response(request: HttpRequest) -> HttpResponseBase:
+        return HttpResponse()
+
+    received: list[dict[str, Any]] = []
+
+    async def async_receiver(**kwargs: Any) -> None:
+        received.append(kwargs)
+
+    def sync_receiver(**kwargs: Any) -> None:
+        received.append(kwargs)
+
+    response_processed.connect(async_receiver)
+    response_processed.connect(sync_receiver)
+    try:
+        request = AsyncRequestFactory().get("/")
+        async_mw = CSPMiddleware(get_response)
+        assert iscoroutinefunction(async_mw)
+        response = asyncio.run(async_mw(request))
+    finally:
+        response_processed.disconnect(async_receiver)
+        response_processed.disconnect(sync_receiver)
+
+    assert [r["response"] for r in received] == [response, response]
+    assert all(isinstance(r["metrics"], Metrics) for r in received)
@@ -1,8 +1,30 @@
+import re
+from types import SimpleNamespace
+
+from django.test import RequestFactory
 from django.test.utils import override_settings
 from django.utils.functional import lazy
 
+import pytest
+
 from csp.constants import NONCE, NONE, SELF
-from csp.utils import DEFAULT_DIRECTIVES, build_policy, default_config
+from csp.utils import (
+    COMPILED_DECORATOR_POLICIES_MAX_SIZE,
+    DEFAULT_DIRECTIVES,
+    Policy,
+    RequestSampler,
+    URLMatcher,
+    build_policy,
+    compile_policy,
+    default_config,
+    find_script_hashes,
+    get_compiled_decorator_policy,
+    get_compiled_decorator_policy_cache_info,
+    get_compiled_policy,
+    get_excluded_url_matcher,
+    script_hash_marker,
+    script_hash_source,
+)
 
 
 def policy_eq(a: str, b: str) -> None:
@@ -332,6 +354,52 @@ def test_nonce_in_value() -> None:
     )
 
 
+def test_hashes() -> None:
+    policy = build_policy(hashes=["'sha256-abc'", "'sha256-def'"])
+    policy_eq("default-src 'self' 'sha256-abc' 'sha256-def'", policy)
+
+
+def test_nonce_and_hashes() -> None:
+    policy = build_policy(nonce="abc123", hashes=["'sha256-abc'"])
+    policy_eq("default-src 'self' 'nonce-abc123' 'sha256-abc'", policy)
+
+
+@override_settings(CONTENT_SECURITY_POLICY={"DIRECTIVES": {"default-src": [SELF, NONCE], "script-src": [NONCE], "style-src": [NONCE, SELF]}})
+def test_hashes_only_in_script_directives() -> None:
+    policy = build_policy(nonce="abc123", hashes=["'sha256-abc'"])
+    policy_eq("default-src 'self' 'nonce-abc123'; script-src 'nonce-abc123' 'sha256-abc'; style-src 'nonce-abc123' 'self'", policy)
+    policy = build_policy(hashes=["'sha256-abc'"])
+    policy_eq("default-src 'self'; script-src 'sha256-abc'; style-src 'self'", policy)
+
+
+@override_settings(CONTENT_SECURITY_POLICY={"DIRECTIVES": {"default-src": [SELF, NONCE], "script-src-elem": [NONCE], "style-src": [NONCE]}})
+def test_hashes_in_script_src_elem() -> None:
+    policy = build_policy(hashes=["'sha256-abc'"])
+    policy_eq("default-src 'self'; script-src-elem 'sha256-abc'; style-src", policy)
+
+
+@override_settings(CONTENT_SECURITY_POLICY={"DIRECTIVES": {"default-src": [SELF]}})
+def test_hashes_without_nonce_sentinel() -> None:
+    policy = build_policy(hashes=["'sha256-abc'"])
+    policy_eq("default-src 'self'", policy)
+
+
+def test_script_hash_source() -> None:
+    assert script_hash_source("") == "'sha256-47DEQpj8HBSa+/TImW+5JCeuQeRkm5NMpJWZG3hSuFU='"
+
+
+def test_find_script_hashes() -> None:
+    script_hash = script_hash_source("var hello='world';")
+    marker = script_hash_marker(script_hash)
+    forged = marker.replace(script_hash[1:-1], script_hash_source("alert(1)")[1:-1])
+    content = f"<p>{forged}</p>{marker}<script>var hello='world';</script>{marker}".encode()
+    assert find_script_hashes(content) == {script_hash: None}
+    assert find_script_hashes(b"<p>No scripts here.</p>") == {}
+    with override_settings(SECRET_KEY="another-secret-key"):
+        assert script_hash_marker(script_hash) != marker
+        assert find_script_hashes(content) == {}
+
+
 @override_settings(CONTENT_SECURITY_POLICY={"DIRECTIVES": {"default-src": [NONCE]}})
 def test_only_nonce_in_value() -> None:
     policy = build_policy(nonce="abc123")
@@ -375,3 +443,153 @@ def test_boolean_directives() -> None:
         with override_settings(CONTENT_SECURITY_POLICY={"DIRECTIVES": {directive: False}}):
             policy = build_policy()
             policy_eq("default-src 'self'", policy)
+
+
+@override_settings(CONTENT_SECURITY_POLICY={"DIRECTIVES": {"default-src": [SELF], "script-src": [SELF, NONCE], "style-src": [NONCE]}})
+def test_compile_policy() -> None:
+    compiled = compile_policy()
+    policy_eq("default-src 'self'; script-src 'self'; style-src", compiled.render())
+    policy_eq(
+        "default-src 'self'; script-src 'self' 'nonce-abc123'; style-src 'nonce-abc123'",
+        compiled.render("abc123"),
+    )
+    assert len(compiled.nonce_parts) == 3
+
+
+def test_compiled_policy_is_cached() -> None:
+    assert get_compiled_policy() is get_compiled_policy()
+    assert get_compiled_policy() is not get_compiled_policy(report_only=True)
+
+
+@override_settings(CONTENT_SECURITY_POLICY={"DIRECTIVES": {"default-src": [SELF], "report-uri": "/report/", "report-to": "endpoint"}})
+def test_compiled_policy_without_reporting() -> None:
+    policy_eq("default-src 'self'; report-to endpoint; report-uri /report/", get_compiled_policy().header)
+    assert get_compiled_policy(reporting=False).header == "default-src 'self'"
+    assert get_compiled_policy(reporting=False) is get_compiled_policy(reporting=False)
+    assert build_policy(reporting=False) == "default-src 'self'"
+
+    replace = Policy({"report-uri": "/other/"})
+    assert build_policy(replace=replace, reporting=False) == "default-src 'self'"
+    assert get_compiled_decorator_policy(replace=replace, reporting=False) is get_compiled_decorator_policy(replace=replace, reporting=False)
+
+
+def test_compiled_policy_cleared_on_setting_changed() -> None:
+    compiled = get_compiled_policy()
+    with override_settings(CONTENT_SECURITY_POLICY={"DIRECTIVES": {"default-src": ["example.com"]}}):
+        assert get_compiled_policy() is not compiled
+        policy_eq("default-src example.com", build_policy())
+    assert get_compiled_policy() is not compiled
+    policy_eq("default-src 'self'", build_policy())
+
+
+def test_policy() -> None:
+    policy = Policy({"img-src": ["example.com", "example.com", NONCE], "font-src": "example.com", "frame-src": None})
+    assert dict(policy) == {"img-src": ("example.com", NONCE), "font-src": ("example.com",), "frame-src": None}
+    assert policy["img-src"] is not None and policy["font-src"] is not None
+    assert policy["img-src"][0] is policy["font-src"][0]
+    assert policy == {"img-src": ["example.com", NONCE], "font-src": ["example.com"], "frame-src": None}
+    assert policy == Policy({"frame-src": None, "font-src": ("example.com",), "img-src": ("example.com", NONCE)})
+    assert hash(policy) == hash(Policy(policy))
+    assert policy != Policy({"img-src": ["example.com"]})
+    assert not hasattr(policy, "__dict__")
+    with pytest.raises(TypeError):
+        policy["img-src"] = ["example2.com"]  # type: ignore[index]
+
+
+def test_policy_set_values() -> None:
+    assert Policy({"img-src": {"b.example.com", "a.example.com"}})["img-src"] == ("a.example.com", "b.example.com")
+
+
+def test_policy_lazy_values_not_evaluated() -> None:
+    def fail() -> str:
+        raise AssertionError("evaluated")
+
+    lazy_fail = lazy(fail, str)()
+    policy = Policy({"report-uri": [lazy_fail]})
+    assert policy["report-uri"] == (lazy_fail,)
+
+
+def test_build_policy_with_policies() -> None:
+    policy = build_policy(config=Policy({"default-src": [SELF], "img-src": ["example.com"]}), update=Policy({"img-src": "example2.com"}))
+    policy_eq("default-src 'self'; img-src example.com example2.com", policy)
+    policy = build_policy(replace=Policy({"img-src": "example2.com"}))
+    policy_eq("default-src 'self'; img-src example2.com", policy)
+
+
+@override_settings(CONTENT_SECURITY_POLICY={"DIRECTIVES": {"default-src": [SELF]}})
+def test_compiled_decorator_policy_cache_info() -> None:
+    policy = Policy({"img-src": ["example.com"]})
+    get_compiled_decorator_policy(None, policy)
+    get_compiled_decorator_policy(None, Policy({"img-src": ["example.com"]}))
+    get_compiled_decorator_policy(None, policy, report_only=True)
+
+    info = get_compiled_decorator_policy_cache_info()
+    assert (info.hits, info.misses, info.currsize) == (1, 2, 2)
+    assert info.maxsize == COMPILED_DECORATOR_POLICIES_MAX_SIZE
+
+
+@override_settings(CONTENT_SECURITY_POLICY={"DIRECTIVES": {"default-src": [SELF]}})
+def test_compiled_decorator_policy_cache_evicts_least_recently_used() -> None:
+    policies = [Policy({"img-src": [f"{i}.example.com"]}) for i in range(COMPILED_DECORATOR_POLICIES_MAX_SIZE + 1)]
+    compiled = [get_compiled_decorator_policy(None, policy) for policy in policies[:-1]]
+    # Use the first policy again, so the second is the least recently used.
+    get_compiled_decorator_policy(None, policies[0])
+    get_compiled_decorator_policy(None, policies[-1])
+
+    assert get_compiled_decorator_policy(None, policies[0]) is compiled[0]
+    assert get_compiled_decorator_policy(None, policies[1]) is not compiled[1]
+
+
+def test_url_matcher() -> None:
+    matcher = URLMatcher(["/admin/", "/api/v1/", "/api/v2/", "/a.b", re.compile(r"/health\Z")])
+    assert matcher.matches("/admin/")
+    assert matcher.matches("/admin/foo")
+    assert matcher.matches("/api/v1/foo")
+    assert matcher.matches("/api/v2/")
+    assert matcher.matches("/a.b/")
+    assert matcher.matches("/health")
+    assert not matcher.matches("/admin")
+    assert not matcher.matches("/api/v3/")
+    assert not matcher.matches("/axb/")
+    assert not matcher.matches("/health/foo")
+    assert not matcher.matches("/foo/admin/")
+
+
+def test_url_matcher_shorter_prefix() -> None:
+    matcher = URLMatcher(["/api/v1/", "/api/"])
+    assert matcher.matches("/api/v2/")
+    assert matcher.matches("/api/v1/")
+
+
+def test_url_matcher_long_prefix() -> None:
+    prefix = "/" + "x" * 5000
+    matcher = URLMatcher([prefix, prefix[:-1] + "y"])
+    assert matcher.matches(prefix + "/")
+    assert matcher.matches(prefix[:-1] + "y")
+    assert not matcher.matches(prefix[:-1])
+
+
+def test_url_matcher_empty() -> None:
+    assert not URLMatcher([]).matches("/")
+    assert URLMatcher([""]).matches("/")
+
+
+@override_settings(CONTENT_SECURITY_POLICY_REPORT_ONLY={"EXCLUDE_URL_PREFIXES": ["/admin/"]})
+def test_excluded_url_matcher_is_cached() -> None:
+    matcher = get_excluded_url_matcher(report_only=True)
+    assert get_excluded_url_matcher(report_only=True) is matcher
+    assert matcher.matches("/admin/")
+    assert not get_excluded_url_matcher().matches("/admin/")
+    with override_settings(CONTENT_SECURITY_POLICY_REPORT_ONLY={"EXCLUDE_URL_PREFIXES": ["/api/"]}):
+        assert not get_excluded_url_matcher(report_only=True).matches("/admin/")
+
+
+def test_request_sampler_attribute_path() -> None:
+    request = RequestFactory().get("/")
+    sampler = RequestSampler(100, "user.pk")
+    assert sampler(request) is False
+    setattr(request, "user", SimpleNamespace(pk=None))
+    assert sampler(request) is False
+    setattr(request, "user", SimpleNamespace(pk=42))
+    assert sampler(request) is True
+    assert RequestSampler(0, "user.pk")(request) is False
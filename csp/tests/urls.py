@@ -0,0 +1,40 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from django.http import HttpResponse
+from django.urls import include, path
+
+from csp.decorators import csp, csp_exempt, csp_update
+
+if TYPE_CHECKING:
+    from django.http import HttpRequest
+
+
+def plain_view(request: HttpRequest) -> HttpResponse:
+    return HttpResponse()
+
+
+@csp_update({"img-src": ["example.com"]})
+def update_view(request: HttpRequest) -> HttpResponse:
+    return HttpResponse()
+
+
+@csp({"default-src": ["example.com"]})
+@csp_update({"img-src": ["example.com"]}, REPORT_ONLY=True)
+def stacked_view(request: HttpRequest) -> HttpResponse:
+    return HttpResponse()
+
+
+@csp_exempt()
+@csp_update({"img-src": ["exempt.example.com"]})
+def exempt_view(request: HttpRequest) -> HttpResponse:
+    return HttpResponse()
+
+
+urlpatterns = [
+    path("", plain_view),
+    path("update/", update_view),
+    path("nested/", include([path("stacked/", stacked_view), path("update/", update_view)])),
+    path("exempt/", exempt_view),
+]
@@ -6,9 +6,10 @@ from typing import TYPE_CHECKING, Any, Callable
 from django.http import HttpResponse
 from django.template import Context, Template, engines
 from django.test import RequestFactory
-from django.utils.functional import SimpleLazyObject
 
+from csp.constants import HEADER
 from csp.middleware import CSPMiddleware
+from csp.nonce import LazyNonce
 
 if TYPE_CHECKING:
     from django.http import HttpRequest
@@ -40,9 +41,17 @@ class ScriptTestBase(ABC):
         request = rf.get("/")
         mw.process_request(request)
         nonce = getattr(request, "csp_nonce")
-        assert isinstance(nonce, SimpleLazyObject)
+        assert isinstance(nonce, LazyNonce)
         return (self.render(tpl, request).strip(), expected.format(nonce))
 
+    def process_templates_with_header(self, tpl: str) -> tuple[str, str]:
+        """Renders the template, and returns the output with the resulting CSP header."""
+        request = rf.get("/")
+        mw.process_request(request)
+        output = self.render(tpl, request).strip()
+        response = mw.process_response(request, HttpResponse(output))
+        return output, response[HEADER]
+
     @abstractmethod
     def render(self, template_string: str, request: HttpRequest) -> str: ...
 
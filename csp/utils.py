@@ -1,14 +1,33 @@
 from __future__ import annotations
 
-import copy
+import base64
+import hashlib
+import json
 import re
+import sys
+import threading
+import warnings
+from collections.abc import Iterable, Iterator, Mapping
+from functools import lru_cache
+from importlib.metadata import version
 from itertools import chain
-from typing import Any, Callable
+from typing import TYPE_CHECKING, Any, Callable
 
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.urls import URLPattern, URLResolver, get_resolver
+from django.utils.crypto import constant_time_compare, salted_hmac
 from django.utils.encoding import force_str
+from django.utils.functional import Promise
 
-from csp.constants import NONCE, SELF
+from csp.constants import HEADER_REPORT_TO, HEADER_REPORTING_ENDPOINTS, NONCE, SELF
+
+if TYPE_CHECKING:
+    from functools import _CacheInfo
+
+    from django.http import HttpRequest
 
 DEFAULT_DIRECTIVES = {
     # Fetch Directives
@@ -51,7 +70,7 @@ DEFAULT_DIRECTIVES = {
     "block-all-mixed-content": False,  # Deprecated.
 }
 
-DIRECTIVES_T = dict[str, Any]
+DIRECTIVES_T = Mapping[str, Any]
 
 
 def default_config(csp: DIRECTIVES_T | None) -> DIRECTIVES_T | None:
@@ -64,14 +83,141 @@ def default_config(csp: DIRECTIVES_T | None) -> DIRECTIVES_T | None:
     return config
 
 
-def build_policy(
+class CompiledPolicy:
+    """
+    A policy header precomputed from a config.
+
+    ``header`` is the policy without a nonce. ``nonce_parts`` holds the fragments of the policy
+    surrounding every position of the ``NONCE`` sentinel, so adding a nonce is a single join.
+    ``hash_slots`` holds whether each of these positions also takes the hash sources of inline
+    scripts, which are only allowed by the directives governing script elements.
+    """
+
+    __slots__ = ("header", "nonce_parts", "hash_slots")
+
+    def __init__(self, header: str, nonce_parts: tuple[str, ...], hash_slots: tuple[bool, ...] = ()) -> None:
+        self.header = header
+        self.nonce_parts = nonce_parts
+        self.hash_slots = hash_slots
+
+    def __repr__(self) -> str:
+        return f"<CompiledPolicy {self.header!r}>"
+
+    def render(self, nonce: str | None = None, hashes: Iterable[str] | None = None) -> str:
+        if len(self.nonce_parts) == 1:
+            return self.header
+        nonce_source = f"'nonce-{nonce}'" if nonce else ""
+        if hashes and True in self.hash_slots:
+            hash_sources = " ".join(chain((nonce_source,) if nonce else (), hashes))
+            parts = [self.nonce_parts[0]]
+            for hash_slot, part in zip(self.hash_slots, self.nonce_parts[1:]):
+                if hash_slot:
+                    parts.append(hash_sources)
+                elif nonce_source:
+                    parts.append(nonce_source)
+                else:
+                    # Drop the separator before the missing source, as in `header`.
+                    parts[-1] = parts[-1][:-1]
+                parts.append(part)
+            return "".join(parts)
+        if nonce_source:
+            return nonce_source.join(self.nonce_parts)
+        return self.header
+
+
+def _normalize_value(v: Any) -> tuple[Any, ...]:
+    if type(v) is tuple:
+        return v
+    if isinstance(v, set):
+        return tuple(sorted(v))
+    if isinstance(v, (list, tuple)):
+        return tuple(v)
+    return (v,)
+
+
+def _intern_value(v: Any) -> tuple[Any, ...]:
+    values = _normalize_value(v)
+    if any(isinstance(x, Promise) for x in values):
+        # Deduplicating would evaluate lazy values, e.g. `reverse_lazy` while URLconfs are being
+        # imported. They are deduplicated when the policy is compiled instead.
+        return values
+    return tuple(dict.fromkeys(sys.intern(x) if type(x) is str else x for x in values))
+
+
+class Policy(Mapping[str, Any]):
+    """
+    An immutable, hashable policy config.
+
+    The values of the directives are stored as deduplicated tuples of interned strings, so merging
+    policies is cheap and a policy can be used as a cache key. A value of ``None`` removes the
+    directive, as in a ``csp_replace`` config.
+    """
+
+    __slots__ = ("_directives", "_hash")
+
+    def __init__(self, directives: DIRECTIVES_T | None = None) -> None:
+        if isinstance(directives, Policy):
+            self._directives: dict[str, tuple[Any, ...] | None] = directives._directives
+        else:
+            self._directives = {sys.intern(k): None if v is None else _intern_value(v) for k, v in (directives or {}).items()}
+        # The hash is computed lazily, since it evaluates any lazy values.
+        self._hash: int | None = None
+
+    def __getitem__(self, key: str) -> tuple[Any, ...] | None:
+        return self._directives[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._directives)
+
+    def __len__(self) -> int:
+        return len(self._directives)
+
+    def __repr__(self) -> str:
+        return f"Policy({self._directives!r})"
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, Policy):
+            return self._directives == other._directives
+        if isinstance(other, Mapping):
+            return self._directives == Policy(other)._directives
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        if self._hash is None:
+            self._hash = hash(frozenset(self._directives.items()))
+        return self._hash
+
+
+# The number of policies compiled, so instrumentation can count the requests that missed the caches.
+_compile_count = 0
+# The same, by thread, so compiles for requests handled by other threads aren't counted.
+_thread_compile_count = threading.local()
+
+
+def get_compile_count() -> int:
+    """Returns the number of policies compiled by this process."""
+    return _compile_count
+
+
+def get_thread_compile_count() -> int:
+    """Returns the number of policies compiled by the calling thread."""
+    return getattr(_thread_compile_count, "value", 0)
+
+
+def compile_policy(
     config: DIRECTIVES_T | None = None,
     update: DIRECTIVES_T | None = None,
     replace: DIRECTIVES_T | None = None,
-    nonce: str | None = None,
     report_only: bool = False,
-) -> str:
-    """Builds the policy as a string from the settings."""
+    reporting: bool = True,
+) -> CompiledPolicy:
+    """
+    Compiles the policy from the settings into a `CompiledPolicy`. If `reporting` is False, the
+    ``report-uri`` and ``report-to`` directives are left out.
+    """
+    global _compile_count
+    _compile_count += 1
+    _thread_compile_count.value = get_thread_compile_count() + 1
 
     if config is None:
         if report_only:
@@ -83,63 +229,488 @@ def build_policy(
 
     # If config is still `None`, return empty policy.
     if config is None:
-        return ""
+        return CompiledPolicy("", ("",))
 
     update = update if update is not None else {}
     replace = replace if replace is not None else {}
 
-    csp = {}
+    csp: dict[str, tuple[Any, ...]] = {}
 
-    for k in set(chain(config, replace)):
+    for k in dict.fromkeys(chain(config, replace)):
         if k in replace:
             v = replace[k]
         else:
             v = config[k]
         if v is not None:
-            v = copy.copy(v)
-            if isinstance(v, set):
-                v = sorted(v)
-            if not isinstance(v, (list, tuple)):
-                v = (v,)
-            csp[k] = v
+            csp[k] = _normalize_value(v)
 
     for k, v in update.items():
         if v is not None:
-            v = copy.copy(v)
-            if isinstance(v, set):
-                v = sorted(v)
-            if not isinstance(v, (list, tuple)):
-                v = (v,)
             if csp.get(k) is None:
-                csp[k] = v
+                csp[k] = _normalize_value(v)
             else:
-                csp[k] += tuple(v)
+                csp[k] += _normalize_value(v)
 
     report_uri = csp.pop("report-uri", None)
-
-    policy_parts = {}
+    if not reporting:
+        report_uri = None
+        csp.pop("report-to", None)
+
+    policy_parts = []
+    # The policy as a flat list of strings, with the `NONCE` sentinel marking where a nonce goes.
+    nonced_parts: list[Any] = []
+    hash_slots = []
+    # Script hashes go where a nonce would allow script elements.
+    hash_directives = {"script-src", "script-src-elem"}
+    if not hash_directives.intersection(csp):
+        hash_directives.add("default-src")
 
     for key, value in csp.items():
         # Check for boolean directives.
         if len(value) == 1 and isinstance(value[0], bool):
             if value[0] is True:
-                policy_parts[key] = ""
+                policy_parts.append(key)
+                nonced_parts.extend(("; ", key))
             continue
-        if NONCE in value:
-            if nonce:
-                value = [f"'nonce-{nonce}'" if v == NONCE else v for v in value]
-            else:
-                # Strip the `NONCE` sentinel value if no nonce is provided.
-                value = [v for v in value if v != NONCE]
 
-        value = list(dict.fromkeys(value))  # Deduplicate
-        policy_parts[key] = " ".join(value)
+        value = tuple(dict.fromkeys(value))  # Deduplicate
+        # Strip the `NONCE` sentinel value for the policy without a nonce.
+        policy_parts.append(f"{key} {' '.join(v for v in value if v is not NONCE)}".strip())
+        nonced_parts.extend(("; ", key))
+        for v in value:
+            nonced_parts.extend((" ", v))
+            if v is NONCE:
+                hash_slots.append(key in hash_directives)
 
     if report_uri:
-        report_uri = map(force_str, report_uri)
-        policy_parts["report-uri"] = " ".join(report_uri)
+        report_uri_value = " ".join(map(force_str, report_uri))
+        policy_parts.append(f"report-uri {report_uri_value}")
+        nonced_parts.extend(("; ", "report-uri ", report_uri_value))
+
+    nonce_parts = [""]
+    # Skip the leading separator.
+    for part in nonced_parts[1:]:
+        if part is NONCE:
+            nonce_parts.append("")
+        else:
+            nonce_parts[-1] += part
+
+    return CompiledPolicy("; ".join(policy_parts), tuple(nonce_parts), tuple(hash_slots))
+
+
+# Policies compiled from the settings, keyed by `report_only` and `reporting`.
+_compiled_policies: dict[tuple[bool, bool], CompiledPolicy] = {}
+
+# The number of policies compiled from decorator configs kept in the least recently used cache.
+COMPILED_DECORATOR_POLICIES_MAX_SIZE = 1024
+
+# Policies loaded by `load_compiled_policies`, keyed by `_policy_key`.
+_loaded_decorator_policies: dict[str, CompiledPolicy] = {}
 
-    return "; ".join([f"{k} {val}".strip() for k, val in policy_parts.items()])
+# Matchers compiled from the `EXCLUDE_URL_PREFIXES` settings, keyed by `report_only`.
+_excluded_url_matchers: dict[bool, URLMatcher] = {}
+
+# The `CONTENT_TYPES` settings, keyed by `report_only`.
+_content_types: dict[bool, frozenset[str] | None] = {}
+
+# The sampler for the `SAMPLE_PERCENTAGE` setting of the report-only policy.
+_report_only_sampler: list[RequestSampler | None] = []
+
+# The headers serialized from the `CONTENT_SECURITY_POLICY_REPORTING_ENDPOINTS` setting.
+_reporting_endpoints_headers: list[tuple[tuple[str, str], ...]] = []
+
+# The markers of script hashes, keyed by hash source.
+_script_hash_markers: dict[str, str] = {}
+
+
+@receiver(setting_changed)
+def _clear_compiled_policies(*, setting: str, **kwargs: Any) -> None:
+    if setting in ("CONTENT_SECURITY_POLICY", "CONTENT_SECURITY_POLICY_REPORT_ONLY"):
+        _compiled_policies.clear()
+        _compile_decorator_policy.cache_clear()
+        _loaded_decorator_policies.clear()
+        _excluded_url_matchers.clear()
+        _content_types.clear()
+        _report_only_sampler.clear()
+    elif setting in ("CONTENT_SECURITY_POLICY_REPORTING_ENDPOINTS", "CONTENT_SECURITY_POLICY_REPORT_TO_MAX_AGE"):
+        _reporting_endpoints_headers.clear()
+
+
+def _is_policy(config: DIRECTIVES_T | None) -> bool:
+    return config is None or isinstance(config, Policy)
+
+
+@lru_cache(maxsize=COMPILED_DECORATOR_POLICIES_MAX_SIZE)
+def _compile_decorator_policy(
+    config: Policy | None, update: Policy | None, replace: Policy | None, report_only: bool, reporting: bool = True
+) -> CompiledPolicy:
+    if not reporting:
+        return compile_policy(config, update, replace, report_only, reporting)
+    if _loaded_decorator_policies:
+        compiled = _loaded_decorator_policies.get(_policy_key(config, update, replace, report_only))
+        if compiled is not None:
+            return compiled
+    return compile_policy(config, update, replace, report_only)
+
+
+def get_compiled_decorator_policy(
+    config: Policy | None = None,
+    update: Policy | None = None,
+    replace: Policy | None = None,
+    report_only: bool = False,
+    reporting: bool = True,
+) -> CompiledPolicy:
+    """
+    Returns the policy compiled from the decorator configs merged with the settings.
+
+    The compiled policies of the most recently used decorator configs are cached until the settings
+    change, so repeat requests to a decorated view reuse the compiled header.
+    """
+    return _compile_decorator_policy(config, update, replace, report_only, reporting)
+
+
+def get_compiled_decorator_policy_cache_info() -> _CacheInfo:
+    """
+    Returns the hits, misses, maximum size and current size of the cache of policies compiled from
+    decorator configs, like `functools.lru_cache`. The counters reset when the settings change.
+    """
+    return _compile_decorator_policy.cache_info()
+
+
+def get_compiled_policy(report_only: bool = False, reporting: bool = True) -> CompiledPolicy:
+    """
+    Returns the policy compiled from the settings, without the reporting directives if
+    `reporting` is False.
+
+    The compiled policy is cached until the settings change, as signalled by Django's
+    ``setting_changed`` signal.
+    """
+    try:
+        return _compiled_policies[report_only, reporting]
+    except KeyError:
+        compiled = _compiled_policies[report_only, reporting] = compile_policy(report_only=report_only, reporting=reporting)
+        return compiled
+
+
+def _iter_views(patterns: Iterable[URLPattern | URLResolver]) -> Iterator[Callable[..., Any]]:
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from _iter_views(pattern.url_patterns)
+        else:
+            yield pattern.callback
+
+
+def _iter_decorated_views(
+    urlconf: str | None = None,
+) -> Iterator[tuple[Callable[..., Any], bool, Policy | None, Policy | None, Policy | None]]:
+    """Yields the view, `report_only` and decorator configs of every decorated view in the URLconf."""
+    for view in dict.fromkeys(_iter_views(get_resolver(urlconf).url_patterns)):
+        for report_only, suffix in ((False, ""), (True, "_ro")):
+            if getattr(view, f"_csp_exempt{suffix}", False):
+                continue
+            config = getattr(view, f"_csp_config{suffix}", None)
+            update = getattr(view, f"_csp_update{suffix}", None)
+            replace = getattr(view, f"_csp_replace{suffix}", None)
+            if config is None and update is None and replace is None:
+                continue
+            if _is_policy(config) and _is_policy(update) and _is_policy(replace):
+                yield view, report_only, config, update, replace
+
+
+def precompile_policies(urlconf: str | None = None) -> int:
+    """
+    Compiles the policies from the settings, and those of every view in the URLconf with decorator
+    configs, so no request has to compile them. Returns the number of decorated views found.
+    """
+    for report_only in (False, True):
+        get_compiled_policy(report_only)
+
+    views = set()
+    for view, report_only, config, update, replace in _iter_decorated_views(urlconf):
+        get_compiled_decorator_policy(config, update, replace, report_only)
+        views.add(view)
+    return len(views)
+
+
+COMPILED_POLICIES_VERSION = 2
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, Mapping):
+        return dict(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=str)
+    if isinstance(value, Promise):
+        return force_str(value)
+    # e.g. the `NONCE` sentinel and compiled regular expressions.
+    return repr(value)
+
+
+def _policy_key(config: Any, update: Any, replace: Any, report_only: bool) -> str:
+    # Decorator configs serialize to the same JSON as their values loaded back from a file.
+    return json.dumps([config, update, replace, report_only], default=_json_default)
+
+
+def _settings_fingerprint() -> str:
+    policies = [getattr(settings, name, None) for name in ("CONTENT_SECURITY_POLICY", "CONTENT_SECURITY_POLICY_REPORT_ONLY")]
+    # A release compiling the same settings differently, e.g. with new default directives, doesn't
+    # accept policies compiled by another one.
+    compiler = [version("django-csp"), COMPILED_POLICIES_VERSION, DEFAULT_DIRECTIVES]
+    return hashlib.sha256(json.dumps([policies, compiler], default=_json_default).encode("utf-8")).hexdigest()
+
+
+def dump_compiled_policies(urlconf: str | None = None) -> dict[str, Any]:
+    """
+    Returns the policies from the settings and of every decorated view in the URLconf, compiled and
+    ready to be serialized as JSON for `load_compiled_policies`.
+    """
+    policies: list[dict[str, Any]] = []
+    for report_only in (False, True):
+        compiled = compile_policy(report_only=report_only)
+        policies.append(
+            {
+                "view": None,
+                "report_only": report_only,
+                "header": compiled.header,
+                "nonce_parts": list(compiled.nonce_parts),
+                "hash_slots": list(compiled.hash_slots),
+            }
+        )
+    for view, report_only, config, update, replace in _iter_decorated_views(urlconf):
+        compiled = compile_policy(config, update, replace, report_only)
+        policies.append(
+            {
+                "view": f"{view.__module__}.{view.__qualname__}",
+                "report_only": report_only,
+                # Round trip through JSON so the configs are stored as they will be loaded.
+                "config": json.loads(json.dumps(config, default=_json_default)),
+                "update": json.loads(json.dumps(update, default=_json_default)),
+                "replace": json.loads(json.dumps(replace, default=_json_default)),
+                "header": compiled.header,
+                "nonce_parts": list(compiled.nonce_parts),
+                "hash_slots": list(compiled.hash_slots),
+            }
+        )
+    return {"version": COMPILED_POLICIES_VERSION, "settings": _settings_fingerprint(), "policies": policies}
+
+
+def load_compiled_policies(path: str) -> bool:
+    """
+    Loads the policies written by the ``csp_compile`` management command into the caches, so they
+    aren't compiled again. Returns False, with a warning, if the file doesn't match the settings.
+    """
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+
+    if data.get("version") != COMPILED_POLICIES_VERSION or data.get("settings") != _settings_fingerprint():
+        warnings.warn(
+            f"Ignoring the compiled CSP policies in {path}, which don't match the settings or the django-csp release. "
+            "Run `manage.py csp_compile` again."
+        )
+        return False
+
+    for entry in data["policies"]:
+        compiled = CompiledPolicy(entry["header"], tuple(entry["nonce_parts"]), tuple(entry["hash_slots"]))
+        if entry["view"] is None:
+            _compiled_policies[entry["report_only"], True] = compiled
+        else:
+            key = _policy_key(entry["config"], entry["update"], entry["replace"], entry["report_only"])
+            _loaded_decorator_policies[key] = compiled
+    return True
+
+
+def _prefix_trie_regex(trie: dict[str, Any]) -> str:
+    # Built bottom up without recursion, so a long prefix doesn't exceed the recursion limit.
+    regexes: dict[int, str] = {}
+    stack = [(trie, False)]
+    while stack:
+        node, children_done = stack.pop()
+        if "" in node:
+            # A prefix ends here, and it matches everything its longer siblings would.
+            regexes[id(node)] = ""
+        elif not children_done:
+            stack.append((node, True))
+            stack.extend((child, False) for child in node.values())
+        else:
+            branches = [re.escape(char) + regexes.pop(id(child)) for char, child in node.items()]
+            regexes[id(node)] = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+    return regexes[id(trie)]
+
+
+class URLMatcher:
+    """
+    Matches URL paths against a list of prefixes and regular expressions.
+
+    Strings are matched as prefixes, and compiled regular expressions are matched from the start of
+    the path. The prefixes are compiled into a single regular expression shaped like a trie, so
+    the cost of a lookup doesn't grow with the number of prefixes.
+    """
+
+    __slots__ = ("_prefix_re", "_patterns")
+
+    def __init__(self, patterns: Iterable[str | re.Pattern[str]]) -> None:
+        trie: dict[str, Any] = {}
+        regexes = []
+        for pattern in patterns:
+            if isinstance(pattern, re.Pattern):
+                regexes.append(pattern)
+                continue
+            node = trie
+            for char in str(pattern):
+                node = node.setdefault(char, {})
+            node[""] = {}
+        self._prefix_re = re.compile(_prefix_trie_regex(trie)) if trie else None
+        self._patterns = tuple(regexes)
+
+    def matches(self, path: str) -> bool:
+        if self._prefix_re is not None and self._prefix_re.match(path):
+            return True
+        return any(pattern.match(path) for pattern in self._patterns)
+
+
+def get_excluded_url_matcher(report_only: bool = False) -> URLMatcher:
+    """
+    Returns the matcher for the ``EXCLUDE_URL_PREFIXES`` of the policy in the settings.
+
+    The matcher is cached until the settings change.
+    """
+    try:
+        return _excluded_url_matchers[report_only]
+    except KeyError:
+        setting_name = "CONTENT_SECURITY_POLICY_REPORT_ONLY" if report_only else "CONTENT_SECURITY_POLICY"
+        policy = getattr(settings, setting_name, None) or {}
+        matcher = _excluded_url_matchers[report_only] = URLMatcher(policy.get("EXCLUDE_URL_PREFIXES", None) or ())
+        return matcher
+
+
+def get_content_types(report_only: bool = False) -> frozenset[str] | None:
+    """
+    Returns the lowercased ``CONTENT_TYPES`` of the policy in the settings, or ``None`` if the
+    policy applies to responses of any content type.
+
+    The content types are cached until the settings change.
+    """
+    try:
+        return _content_types[report_only]
+    except KeyError:
+        setting_name = "CONTENT_SECURITY_POLICY_REPORT_ONLY" if report_only else "CONTENT_SECURITY_POLICY"
+        policy = getattr(settings, setting_name, None) or {}
+        content_types = policy.get("CONTENT_TYPES", None)
+        if content_types is not None:
+            content_types = frozenset(content_type.lower() for content_type in content_types)
+        _content_types[report_only] = content_types
+        return content_types
+
+
+def _attribute_getter(path: str) -> Callable[[HttpRequest], Any]:
+    names = path.split(".")
+
+    def get(request: HttpRequest) -> Any:
+        value: Any = request
+        for name in names:
+            value = value.get(name) if isinstance(value, Mapping) else getattr(value, name, None)
+            if value is None:
+                return None
+        return value
+
+    return get
+
+
+class RequestSampler:
+    """
+    Selects `percentage` percent of requests by a hash of a value identifying them, such as a
+    user's ID, so the same requests are selected in every process.
+
+    `key` is a callable returning the value for a request, or a dotted path to it from the request,
+    looking up keys in mappings and attributes otherwise, e.g. ``"META.REMOTE_ADDR"``. Requests
+    without a value are never selected.
+    """
+
+    __slots__ = ("key", "_threshold")
+
+    def __init__(self, percentage: float, key: str | Callable[[HttpRequest], Any]) -> None:
+        self.key = _attribute_getter(key) if isinstance(key, str) else key
+        # Raising the percentage keeps the requests already selected, as the threshold only grows.
+        self._threshold = int(percentage * 2**64 / 100)
+
+    def __call__(self, request: HttpRequest) -> bool:
+        value = self.key(request)
+        if value is None:
+            return False
+        digest = hashlib.blake2b(str(value).encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "big") < self._threshold
+
+
+def get_report_only_sampler() -> RequestSampler | None:
+    """
+    Returns the sampler for the ``SAMPLE_PERCENTAGE`` and ``SAMPLE_KEY`` of the report-only
+    policy in the settings, or None if every request gets the report-only policy.
+
+    The sampler is cached until the settings change.
+    """
+    if not _report_only_sampler:
+        policy = getattr(settings, "CONTENT_SECURITY_POLICY_REPORT_ONLY", None) or {}
+        percentage = policy.get("SAMPLE_PERCENTAGE", None)
+        sampler = None
+        if percentage is not None:
+            key = policy.get("SAMPLE_KEY", None)
+            if key is None:
+                raise ImproperlyConfigured("SAMPLE_PERCENTAGE requires SAMPLE_KEY in CONTENT_SECURITY_POLICY_REPORT_ONLY.")
+            sampler = RequestSampler(percentage, key)
+        _report_only_sampler.append(sampler)
+    return _report_only_sampler[0]
+
+
+def _structured_field_string(value: str) -> str:
+    # Only backslashes and double quotes are escaped in a structured field string.
+    escaped = value.replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{escaped}"'
+
+
+def get_reporting_endpoints_headers() -> tuple[tuple[str, str], ...]:
+    """
+    Returns the ``Reporting-Endpoints`` header, and the legacy ``Report-To`` header if
+    ``CONTENT_SECURITY_POLICY_REPORT_TO_MAX_AGE`` is set, for the endpoints in the
+    ``CONTENT_SECURITY_POLICY_REPORTING_ENDPOINTS`` setting, as ``(name, value)`` pairs.
+
+    The headers are serialized once, and cached until the settings change.
+    """
+    if not _reporting_endpoints_headers:
+        endpoints = {name: force_str(url) for name, url in (getattr(settings, "CONTENT_SECURITY_POLICY_REPORTING_ENDPOINTS", None) or {}).items()}
+        headers: list[tuple[str, str]] = []
+        if endpoints:
+            value = ", ".join(f"{name}={_structured_field_string(url)}" for name, url in endpoints.items())
+            headers.append((HEADER_REPORTING_ENDPOINTS, value))
+            max_age = getattr(settings, "CONTENT_SECURITY_POLICY_REPORT_TO_MAX_AGE", None)
+            if max_age is not None:
+                groups = ({"group": name, "max_age": max_age, "endpoints": [{"url": url}]} for name, url in endpoints.items())
+                headers.append((HEADER_REPORT_TO, ", ".join(json.dumps(group, separators=(",", ":")) for group in groups)))
+        _reporting_endpoints_headers.append(tuple(headers))
+    return _reporting_endpoints_headers[0]
+
+
+def build_policy(
+    config: DIRECTIVES_T | None = None,
+    update: DIRECTIVES_T | None = None,
+    replace: DIRECTIVES_T | None = None,
+    nonce: str | None = None,
+    report_only: bool = False,
+    hashes: Iterable[str] | None = None,
+    reporting: bool = True,
+) -> str:
+    """
+    Builds the policy as a string from the settings. The nonce and any `hashes` sources are added
+    where the ``NONCE`` sentinel is. If `reporting` is False, the ``report-uri`` and ``report-to``
+    directives are left out.
+    """
+
+    if config is None and update is None and replace is None:
+        compiled = get_compiled_policy(report_only, reporting)
+    elif _is_policy(config) and _is_policy(update) and _is_policy(replace):
+        compiled = get_compiled_decorator_policy(config, update, replace, report_only, reporting)  # type: ignore[arg-type]
+    else:
+        compiled = compile_policy(config, update, replace, report_only, reporting)
+    return compiled.render(nonce, hashes)
 
 
 def _default_attr_mapper(attr_name: str, val: str) -> str:
@@ -205,6 +776,82 @@ def _unwrap_script(text: str) -> str:
     return text
 
 
+def script_hash_source(content: str) -> str:
+    """Returns the ``'sha256-...'`` source allowing an inline script with the given content."""
+    digest = hashlib.sha256(content.encode("utf-8")).digest()
+    return f"'sha256-{base64.b64encode(digest).decode('ascii')}'"
+
+
+def constant_script_hash(content: str) -> str:
+    """Returns the hash source of the script `build_script_tag` renders from a constant body."""
+    return script_hash_source(_unwrap_script(content.strip()))
+
+
+def use_script_hash(request: HttpRequest | None, script_hash: str | None) -> bool:
+    """
+    Registers the hash source of a constant inline script on the request, when
+    ``CONTENT_SECURITY_POLICY_SCRIPT_HASHES`` is enabled. Returns whether the script can be rendered
+    without a nonce.
+    """
+    if script_hash is None or request is None or not getattr(settings, "CONTENT_SECURITY_POLICY_SCRIPT_HASHES", False):
+        return False
+    hashes = getattr(request, "_csp_hashes", None)
+    if hashes is None:
+        hashes = {}
+        setattr(request, "_csp_hashes", hashes)
+    # A dict keeps the hashes unique and in a stable order, so the header is the same for every render.
+    hashes[script_hash] = None
+    return True
+
+
+@receiver(setting_changed)
+def _clear_script_hash_markers(*, setting: str, **kwargs: Any) -> None:
+    if setting == "SECRET_KEY":
+        _script_hash_markers.clear()
+
+
+_script_hash_marker_re = re.compile(rb"<!--csp-hash:(sha256-[A-Za-z0-9+/=]+):([0-9a-f]{32})-->")
+
+
+def _sign_script_hash(script_hash: str) -> str:
+    return salted_hmac("csp.utils.script_hash_marker", script_hash).hexdigest()[:32]
+
+
+def script_hash_marker(script_hash: str) -> str:
+    """
+    Returns the HTML comment rendered before a script allowed by `script_hash`, from which
+    `find_script_hashes` recovers the hash when the page is replayed from a cache.
+
+    The marker is signed with ``SECRET_KEY``, so a marker injected into a page can't allow a script.
+    """
+    try:
+        return _script_hash_markers[script_hash]
+    except KeyError:
+        marker = _script_hash_markers[script_hash] = f"<!--csp-hash:{script_hash[1:-1]}:{_sign_script_hash(script_hash)}-->"
+        return marker
+
+
+def find_script_hashes(content: bytes, hashes: dict[str, None] | None = None) -> dict[str, None]:
+    """
+    Returns the hash sources of the validly signed script hash markers in a response body, added to
+    `hashes` if given. The signatures of hashes already in `hashes` aren't checked again.
+    """
+    if hashes is None:
+        hashes = {}
+    if b"<!--csp-hash:" not in content:
+        return hashes
+    for match in _script_hash_marker_re.finditer(content):
+        script_hash = f"'{match.group(1).decode('ascii')}'"
+        if script_hash not in hashes and constant_time_compare(match.group(2), _sign_script_hash(script_hash)):
+            hashes[script_hash] = None
+    return hashes
+    for match in _script_hash_marker_re.finditer(content):
+        script_hash = f"'{match.group(1).decode('ascii')}'"
+        if constant_time_compare(match.group(2), _sign_script_hash(script_hash)):
+            hashes[script_hash] = None
+    return hashes
+
+
 def build_script_tag(content: str | None = None, **kwargs: Any) -> str:
     data = {}
     # Iterate all possible script attrs instead of kwargs to make
@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+import json
+from typing import TYPE_CHECKING
+
+from django.http import HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from csp.reports import get_report_queue, get_reports_config, parse_reports
+
+if TYPE_CHECKING:
+    from django.http import HttpRequest
+
+REPORT_CONTENT_TYPES = ("application/csp-report", "application/reports+json", "application/json")
+
+
+@csrf_exempt
+@require_POST
+def report(request: HttpRequest) -> HttpResponse:
+    """
+    Receives violation reports sent to ``report-uri`` or a Reporting API endpoint, and queues them
+    to be sent to the sink configured in ``CONTENT_SECURITY_POLICY_REPORTS``.
+    """
+    if request.content_type not in REPORT_CONTENT_TYPES:
+        return HttpResponse(status=415)
+
+    max_body_size = get_reports_config()["MAX_BODY_SIZE"]
+    try:
+        content_length = int(request.META.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        content_length = 0
+    if content_length > max_body_size:
+        return HttpResponse(status=413)
+    # Don't trust the header. Under WSGI this never reads more than the limit into memory, but under
+    # ASGI Django has already spooled the whole body, so the server in front must limit it too.
+    body = request.read(max_body_size + 1)
+    if len(body) > max_body_size:
+        return HttpResponse(status=413)
+
+    try:
+        reports = parse_reports(json.loads(body))
+    except (ValueError, RecursionError):
+        # Deeply nested bodies fit under the size limit but exhaust the parser's recursion limit.
+        return HttpResponse(status=400)
+
+    report_queue = get_report_queue()
+    for violation in reports:
+        report_queue.put(violation)
+    # Dropped reports are accepted too, so browsers don't retry them.
+    return HttpResponse(status=204)